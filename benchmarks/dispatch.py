@@ -0,0 +1,103 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#     "markdown-it-py",
+#     "linkify-it-py",
+#     "pyxel",
+# ]
+# ///
+"""Visitor のディスパッチのベンチマーク
+
+合成した1000スライドのデッキで、従来の getattr による再帰的な walk と
+ディスパッチ表による反復的な walk のレイアウト時間を比較する。
+
+    uv run make.py bench dispatch [--slides 1000] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import time
+import types
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / "pyxel-slide"
+os.chdir(APP_DIR)
+sys.path.insert(0, str(APP_DIR))
+
+import markdown_it  # noqa: E402
+
+import main  # noqa: E402
+
+SLIDE = """\
+### スライド {n}
+
+Pyxelで作る**レトロ**プレゼン*スライド* `code` と [リンク](https://example.com)
+
+- 箇条書き {n}
+  - 入れ子の箇条書き
+    1. 番号付き
+    2. 番号付き
+
+<br>
+
+> 未対応のトークン
+"""
+
+
+class LegacyVisitor(main.Visitor):
+    """従来の walk / visit / depart（未対応トークンの print は除く）"""
+
+    def walk(self, tokens):
+        for token in tokens:
+            self.visit(token)
+            if token.children:
+                self.walk(token.children)
+            self.depart(token)
+
+    def visit(self, token):
+        method_name = f"visit_{token.type}"
+        if hasattr(self, method_name):
+            method = getattr(self, method_name)
+            method(token)
+
+    def depart(self, token):
+        method_name = f"depart_{token.type}"
+        if hasattr(self, method_name):
+            method = getattr(self, method_name)
+            method(token)
+
+
+def layout(visitor_class, app, slides):
+    t = time.perf_counter()
+    for page, tokens in enumerate(slides):
+        visitor_class(app, page).walk(tokens)
+    return time.perf_counter() - t
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--slides", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    md = markdown_it.MarkdownIt("gfm-like")
+    slides = [md.parse(SLIDE.format(n=n)) for n in range(args.slides)]
+    tokens = sum(len(t) + sum(len(c.children or ()) for c in t) for t in slides)
+    app = types.SimpleNamespace(slides=[])
+    layout(main.Visitor, app, slides[:10])  # フォントと文字幅表の読み込み
+
+    print(f"{args.slides} slides, {tokens} tokens, best of {args.repeat}")
+    results = {}
+    for name, cls in (("legacy", LegacyVisitor), ("dispatch", main.Visitor)):
+        results[name] = min(layout(cls, app, slides) for _ in range(args.repeat))
+        print(
+            f"{name:>8}: {results[name] * 1000:8.1f} ms "
+            f"({results[name] / args.slides * 1e6:6.1f} us/slide)"
+        )
+    print(f"speedup: {results['legacy'] / results['dispatch']:.2f}x")
+    print("unsupported:", dict(main.Visitor.unsupported_types(sum(slides, []))))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,92 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#     "pyxel",
+# ]
+# ///
+"""Visitor.visit_text の折り返しベンチマーク
+
+従来の方式（全体から1文字ずつ縮めて Font.text_width を呼ぶ）と break_lines を
+1k〜50k文字の段落で比較し、区切り位置が一致することも確認する。
+
+    uv run make.py bench linebreak [--legacy-max 2000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / "pyxel-slide"
+os.chdir(APP_DIR)
+sys.path.insert(0, str(APP_DIR))
+
+import main  # noqa: E402
+
+SIZES = [1_000, 2_000, 5_000, 10_000, 20_000, 50_000]
+CHARS = "あいうえおかきくけこアイウエオ漢字表示日本語、。「」ABCabc 123"
+
+
+def legacy_break_lines(font, content, max_width):
+    """main.py の従来の折り返し処理（区切り位置だけを返す）"""
+    breaks = []
+    pos = 0
+    while content:
+        i = len(content)
+        w = font.text_width(content)
+        while w > max_width:
+            i -= 1
+            w = font.text_width(content[:i])
+        pos += i
+        breaks.append(pos)
+        content = content[i:]
+    return breaks
+
+
+def measure(func, *args):
+    t = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - t) * 1000
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--font", default="default", choices=list(main.FONTS))
+    parser.add_argument(
+        "--legacy-max", type=int, default=2_000, help="従来方式を計測する最大文字数"
+    )
+    parser.add_argument("--kinsoku", action="store_true", help="禁則処理ありも計測")
+    args = parser.parse_args()
+
+    font = main.FONTS[args.font]
+    metrics = main.FONTS.metrics(args.font)
+    max_width = main.WIDTH - main.WINDOW_PADDING
+    rnd = random.Random(0)
+
+    print(
+        f"{'chars':>8} {'lines':>6} {'legacy ms':>10} {'break ms':>9} {'kinsoku ms':>10}"
+    )
+    for size in SIZES:
+        content = "".join(rnd.choice(CHARS) for _ in range(size))
+        widths, widths_ms = measure(metrics.char_widths, content)
+        breaks, ms = measure(main.break_lines, content, widths, max_width)
+        ms += widths_ms
+
+        legacy = "-"
+        if size <= args.legacy_max:
+            expected, legacy_ms = measure(legacy_break_lines, font, content, max_width)
+            assert breaks == expected, f"line breaks differ at {size} chars"
+            legacy = f"{legacy_ms:10.1f}"
+
+        kinsoku = "-"
+        if args.kinsoku:
+            _, kinsoku_ms = measure(main.break_lines, content, widths, max_width, True)
+            kinsoku = f"{kinsoku_ms + widths_ms:10.1f}"
+
+        print(f"{size:8} {len(breaks):6} {legacy:>10} {ms:9.2f} {kinsoku:>10}")
+
+
+if __name__ == "__main__":
+    run()
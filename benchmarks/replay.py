@@ -0,0 +1,359 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#     "markdown-it-py",
+#     "linkify-it-py",
+#     "pygments",
+#     "pyxel",
+# ]
+# ///
+"""入力を再生してプレゼンのフレーム時間を計測するベンチマーク
+
+スクリプト化した（またはJSONで記録した）入力のタイムラインを、ウィンドウなし・
+フレーム上限なしで App.update / App.draw に流し、フレームごとの時間と
+レンダリング済みページ画像のキャッシュのヒット・ミスを記録する。
+FPSは30固定とみなすので、ページ切替アニメーションのフレーム数や子アプリの
+update の回数は実機と同じになる。最初の --warmup 回（フォントやレキサーの読み込み、
+子アプリの import を含む）は捨て、続く --repeat 回のフレームごとの中央値を使う。
+
+    uv run make.py bench replay [--scenario mixed] [--timeline FILE] [--repeat 5]
+                                [--save BASELINE.json] [--compare BASELINE.json]
+
+タイムラインのJSON: {"frames": N, "events": [[frame, "down", "KEY_SPACE"],
+[frame, "up", "KEY_SPACE"], [frame, "mouse", x, y], ...]}
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("SDL_VIDEODRIVER", "offscreen")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+CWD = Path.cwd()
+APP_DIR = Path(__file__).resolve().parent.parent / "pyxel-slide"
+os.chdir(APP_DIR)
+sys.path.insert(0, str(APP_DIR))
+
+import pyxel  # noqa: E402
+
+import main  # noqa: E402
+
+FPS = 30
+PERCENTILES = (50, 95, 99)
+WARMUP = 1  # 計測せずに捨てる再生の回数
+REPEAT = 5  # 計測する再生の回数
+TOLERANCE = 0.10  # これ以上遅くなったら退行とみなす割合
+MIN_DELTA_MS = 0.5  # 計測誤差とみなす差（割合と差の両方を超えたら退行）
+
+
+class Timeline:
+    """入力イベントの並び"""
+
+    def __init__(self, frames: int = 0, events: list | None = None):
+        self.frames = frames
+        self.events = (
+            events or []
+        )  # [frame, "down" | "up", key] / [frame, "mouse", x, y]
+
+    def press(self, key: str, at: int, hold: int = 1) -> int:
+        """at フレームから hold フレーム key を押し、離した次のフレームを返す"""
+        self.events.append([at, "down", key])
+        self.events.append([at + hold, "up", key])
+        self.frames = max(self.frames, at + hold + 1)
+        return at + hold
+
+    def mouse(self, at: int, x: int, y: int):
+        self.events.append([at, "mouse", x, y])
+        self.frames = max(self.frames, at + 1)
+
+    def wait(self, at: int, frames: int) -> int:
+        self.frames = max(self.frames, at + frames)
+        return at + frames
+
+    def by_frame(self) -> dict[int, list]:
+        result = {}
+        for event in self.events:
+            result.setdefault(event[0], []).append(event[1:])
+        return result
+
+    def to_json(self) -> dict:
+        return {
+            "frames": self.frames,
+            "events": sorted(self.events, key=lambda e: e[0]),
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Timeline":
+        return cls(data["frames"], data["events"])
+
+
+class ReplayInput:
+    """pyxel の入力 (btn, btnp, btnr, mouse_x, mouse_y, frame_count) をタイムラインで置き換える
+
+    子アプリも同じ pyxel モジュールを参照するので、モジュールの属性を差し替える。
+    """
+
+    NAMES = ("btn", "btnp", "btnr", "mouse_x", "mouse_y", "frame_count")
+
+    def __init__(self, timeline: Timeline):
+        self.events = timeline.by_frame()
+        self.frame = 0
+        self.down = {}  # key: 押したフレーム
+        self.released = {}  # key: 離したフレーム
+        self.saved = {}
+
+    def install(self):
+        self.saved = {name: getattr(pyxel, name) for name in self.NAMES}
+        pyxel.btn = self.btn
+        pyxel.btnp = self.btnp
+        pyxel.btnr = self.btnr
+        pyxel.mouse_x = pyxel.mouse_y = 0
+
+    def uninstall(self):
+        for name, value in self.saved.items():
+            setattr(pyxel, name, value)
+
+    def step(self, frame: int):
+        self.frame = pyxel.frame_count = frame
+        for kind, *args in self.events.get(frame, ()):
+            if kind == "down":
+                self.down[getattr(pyxel, args[0])] = frame
+            elif kind == "up":
+                key = getattr(pyxel, args[0])
+                self.down.pop(key, None)
+                self.released[key] = frame
+            elif kind == "mouse":
+                pyxel.mouse_x, pyxel.mouse_y = args
+
+    def btn(self, key: int) -> bool:
+        return key in self.down
+
+    def btnp(self, key: int, hold: int | None = None, repeat: int | None = None):
+        since = self.down.get(key)
+        if since is None:
+            return False
+        d = self.frame - since
+        if d == 0:
+            return True
+        # hold フレーム押し続けたら repeat フレームごとに押したことにする
+        return bool(hold and repeat and d >= hold and (d - hold) % repeat == 0)
+
+    def btnr(self, key: int) -> bool:
+        return self.released.get(key) == self.frame
+
+
+def scenario_forward(app, t: Timeline, at: int) -> int:
+    """最後のページまで go_forward で素早く進み、最初まで戻る"""
+    for _ in range(len(app.slides) - 1):
+        at = t.press("KEY_SPACE", at, hold=1) + 3
+    for _ in range(len(app.slides) - 1):
+        t.press("KEY_SHIFT", at, hold=2)
+        at = t.press("KEY_SPACE", at, hold=1) + 3
+    return t.wait(at, FPS)
+
+
+def scenario_sections(app, t: Timeline, at: int) -> int:
+    """セクション移動で進み、セクション内を下って、セクション移動で戻る"""
+    sections = len(app.first_pages_in_section)
+    for _ in range(sections - 1):
+        at = t.press("KEY_RIGHT", at) + 12  # 切替アニメーションを待つ
+        at = t.press("KEY_DOWN", at) + 12
+    for _ in range(sections - 1):
+        at = t.press("KEY_LEFT", at) + 12
+    return t.wait(at, FPS)
+
+
+def scenario_hover(app, t: Timeline, at: int) -> int:
+    """子アプリのあるページに移動し、マウスを子アプリに乗せて操作する"""
+    page = 0
+    for target in range(len(app.slides)):
+        children = app.layout_page(target).children
+        if not children:
+            continue
+        while page < target:
+            at = t.press("KEY_SPACE", at) + 2
+            page += 1
+        at = t.wait(at, 12)
+        x, y, w, h, _, scale = children[0]
+        t.mouse(
+            at, pyxel.width // 2, main.WINDOW_PADDING + y + int(h * (scale or 1)) // 2
+        )
+        at = t.press("KEY_SPACE", at + 1) + 1  # typinggame の開始
+        for key in ("KEY_A", "KEY_E", "KEY_RIGHT", "KEY_LEFT", "KEY_1"):
+            at = t.press(key, at, hold=4) + 2
+        at = t.wait(at, FPS * 2)
+        t.mouse(at, 0, 0)
+        at += 1
+    while page > 0:
+        t.press("KEY_SHIFT", at, hold=2)
+        at = t.press("KEY_SPACE", at) + 2
+        page -= 1
+    return t.wait(at, FPS)
+
+
+SCENARIOS = {
+    "forward": [scenario_forward],
+    "sections": [scenario_sections],
+    "hover": [scenario_hover],
+    "mixed": [scenario_forward, scenario_sections, scenario_hover],
+}
+
+
+def percentiles(values: list[float]) -> dict:
+    values = sorted(values)
+    result = {}
+    for p in PERCENTILES:
+        i = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+        result[f"p{p}"] = round(values[i], 4)
+    result["mean"] = round(statistics.mean(values), 4)
+    result["max"] = round(values[-1], 4)
+    return result
+
+
+def replay(app, timeline: Timeline) -> list[list]:
+    """timeline を1回再生し、フレームごとの [update_ms, draw_ms, hits, misses, page]"""
+    app.fps.calc = lambda: None  # 30FPS固定とみなす
+    app.fps.value = FPS
+    bank = app.render_bank
+    replay_input = ReplayInput(timeline)
+    replay_input.install()
+    app.scheduler.clock = lambda: replay_input.frame / FPS
+    frames = []
+    try:
+        for frame in range(timeline.frames):
+            replay_input.step(frame)
+            hits, misses = bank.hits, bank.misses
+            t0 = time.perf_counter()
+            app.update()
+            t1 = time.perf_counter()
+            app.draw()
+            t2 = time.perf_counter()
+            frames.append(
+                [
+                    round((t1 - t0) * 1000, 4),
+                    round((t2 - t1) * 1000, 4),
+                    bank.hits - hits,
+                    bank.misses - misses,
+                    app.page,
+                ]
+            )
+    finally:
+        replay_input.uninstall()
+        app.scheduler.clock = time.perf_counter
+    return frames
+
+
+def replay_repeated(app, timeline: Timeline, repeat: int, warmup: int) -> dict:
+    """warmup 回再生して捨ててから repeat 回再生し、update と draw の時間は
+    フレームごとの中央値を使う"""
+    runs = []
+    for i in range(warmup + repeat):
+        if i:
+            app._page = 0
+            app.reset()  # ページ画像のキャッシュや子アプリを初期状態に戻す
+        frames = replay(app, timeline)
+        if i >= warmup:
+            runs.append(frames)
+    frames = [
+        [
+            round(statistics.median([r[0] for r in rows]), 4),
+            round(statistics.median([r[1] for r in rows]), 4),
+            *rows[-1][2:],
+        ]
+        for rows in zip(*runs)
+    ]
+    return {
+        "repeat": repeat,
+        "warmup": warmup,
+        "update_ms": percentiles([f[0] for f in frames]),
+        "draw_ms": percentiles([f[1] for f in frames]),
+        "frame_ms": percentiles([f[0] + f[1] for f in frames]),
+        "render_bank": app.render_bank.stats(),
+        "prerendered": app.prerenderer.rendered,
+        "frames": frames,  # [update_ms, draw_ms, hits, misses, page]
+    }
+
+
+def compare(baseline: dict, result: dict, tolerance: float) -> bool:
+    """退行があれば False"""
+    ok = True
+    print(f"{'metric':<16} {'baseline':>10} {'current':>10} {'change':>8}")
+    for group in ("frame_ms", "update_ms", "draw_ms"):
+        for key in [f"p{p}" for p in PERCENTILES] + ["mean"]:
+            old, new = baseline[group][key], result[group][key]
+            change = (new - old) / old if old else 0.0
+            regressed = change > tolerance and new - old > MIN_DELTA_MS
+            ok &= not regressed
+            mark = "  REGRESSION" if regressed else ""
+            print(
+                f"{group + '.' + key:<16} {old:10.3f} {new:10.3f} {change:+8.1%}{mark}"
+            )
+    for key in ("hits", "misses"):
+        old, new = baseline["render_bank"][key], result["render_bank"][key]
+        print(f"{'bank.' + key:<16} {old:10d} {new:10d}")
+    return ok
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=list(SCENARIOS), default="mixed")
+    parser.add_argument("--timeline", help="記録したタイムライン (JSON)")
+    parser.add_argument("--dump-timeline", help="使ったタイムラインをJSONで保存")
+    parser.add_argument("--save", help="結果をベースラインとしてJSONで保存")
+    parser.add_argument(
+        "--compare", help="ベースラインのJSONと比較（退行があれば終了コード1）"
+    )
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--warmup", type=int, default=WARMUP)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    app = main.App(run=False)
+    if args.timeline:
+        timeline = Timeline.from_json(json.loads((CWD / args.timeline).read_text()))
+        name = Path(args.timeline).stem
+    else:
+        timeline, at, name = Timeline(), 0, args.scenario
+        for scenario in SCENARIOS[args.scenario]:
+            at = scenario(app, timeline, at)
+    if args.dump_timeline:
+        (CWD / args.dump_timeline).write_text(json.dumps(timeline.to_json()))
+
+    result = {
+        "scenario": name,
+        "deck_sha1": hashlib.sha1(Path(main.MD_FILENAME).read_bytes()).hexdigest(),
+        "python": platform.python_version(),
+        "pyxel": pyxel.VERSION,
+        "frame_count": timeline.frames,
+        **replay_repeated(app, timeline, max(args.repeat, 1), max(args.warmup, 0)),
+    }
+    print(f"{name}: {timeline.frames} frames, page {result['frames'][-1][4]} at end")
+    for group in ("frame_ms", "update_ms", "draw_ms"):
+        stats = " ".join(f"{k} {v:.3f}" for k, v in result[group].items())
+        print(f"  {group:<10} {stats}")
+    bank = result["render_bank"]
+    print(
+        f"  render bank: {bank['hits']} hits, {bank['misses']} misses, "
+        f"{bank['evictions']} evictions, {result['prerendered']} prerendered"
+    )
+
+    if args.save:
+        (CWD / args.save).write_text(json.dumps(result, indent=1))
+        print("saved:", args.save)
+    if args.compare:
+        baseline = json.loads((CWD / args.compare).read_text())
+        if baseline["scenario"] != name or baseline["deck_sha1"] != result["deck_sha1"]:
+            print("warning: baseline was recorded with a different scenario or deck")
+        if not compare(baseline, result, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,344 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#     "markdown-it-py",
+#     "linkify-it-py",
+#     "pygments",
+#     "pyxel",
+# ]
+# ///
+"""Visitor.walk と App.render_page のベンチマーク
+
+slide-ja.md と、生成した負荷の高いデッキ（大量のスライド、長い段落、深い入れ子の
+箇条書き、200行のハイライト付きコード、大量のリンク、大量の {figure} 画像）で、
+スライドあたりの時間、トークン type ごとの時間、メモリ確保量を計測する。
+
+    uv run make.py bench visitor [--deck fences --deck lists] [--scale 0.5] [--json FILE]
+
+- layout: 最初の Visitor.walk（ハイライトや画像のキャッシュが空の状態）
+- render: レイアウト済みでない状態からの render_page（ハイライトや画像のキャッシュも空）
+- replay: レイアウト済みの DisplayList からの render_page
+- token types: prepare_* / visit_* / depart_* の時間（子トークンの時間は含まない）。
+  layout と同じくキャッシュを空にしてから計測する
+- alloc: tracemalloc で計測した layout 中の最大確保量と、残った DisplayList の大きさ
+  （時間計測とは別に実行）
+
+フォントや Pygments のレキサーなど、プロセスで一度だけ読み込むものは計測に含まない。
+キャッシュ (CACHE_DIR) は一時ディレクトリに作り、本来の .cache には書かない。
+"""
+
+import argparse
+import collections
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+os.environ.setdefault("SDL_VIDEODRIVER", "offscreen")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+CWD = Path.cwd()
+APP_DIR = Path(__file__).resolve().parent.parent / "pyxel-slide"
+os.chdir(APP_DIR)
+sys.path.insert(0, str(APP_DIR))
+
+import main  # noqa: E402
+
+ASSETS = APP_DIR / "assets"
+TEXT = "Pyxelで作る**レトロ**なプレゼン*スライド*、`code` と日本語の折り返し。"
+
+
+def deck_many(n: int) -> str:
+    """普通の内容のスライドを大量に"""
+    return "\n".join(
+        (
+            f"## セクション {i}\n\n{TEXT}\n\n- 箇条書き {i}\n  - 入れ子\n\n"
+            f"[リンク](https://example.com/{i})\n\n```python\nprint({i})\n```\n"
+            if i % 10 == 0
+            else f"### スライド {i}\n\n{TEXT}\n\n1. 番号付き {i}\n2. 番号付き\n"
+        )
+        for i in range(n)
+    )
+
+
+def deck_paragraphs(n: int) -> str:
+    """5000文字程度の段落"""
+    return "\n".join(f"### 長文 {i}\n\n{TEXT * 130}\n" for i in range(n))
+
+
+def deck_lists(n: int, depth: int = len(main.LIST_MARKERS) - 1) -> str:
+    """深い入れ子の箇条書き（マーカーがある最大の深さまで）"""
+    items = "".join(
+        f"{'  ' * d}- レベル {d} の項目\n{'  ' * d}- レベル {d} の項目 `code`\n"
+        for d in range(depth)
+    )
+    return "\n".join(f"### 箇条書き {i}\n\n{items}" for i in range(n))
+
+
+def deck_fences(n: int, lines: int = 200) -> str:
+    """200行のハイライト付きコード（スライドごとに内容を変える）"""
+    slides = []
+    for i in range(n):
+        code = "\n".join(
+            f'def func_{i}_{j}(x, y="value"):\n    return x + {j} if x and y else None'
+            for j in range(lines // 2)
+        )
+        slides.append(f"### コード {i}\n\n```python\n{code}\n```\n")
+    return "\n".join(slides)
+
+
+def deck_links(n: int, links: int = 100) -> str:
+    """1スライドに大量のリンク"""
+    body = " ".join(f"[link{j}](https://example.com/{j})" for j in range(links))
+    return "\n".join(f"### リンク {i}\n\n{body}\n" for i in range(n))
+
+
+def deck_figures(n: int) -> str:
+    """1スライドに複数の画像（scale もばらばら）"""
+    figures = [
+        ("face-dot.png", 25),
+        ("face-dot.png", 50),
+        ("jumpman.png", 30),
+        ("typinggame.png", 40),
+        ("urban_rpg.png", None),
+    ]
+    slides = []
+    for i in range(n):
+        body = ""
+        for name, scale in figures:
+            option = f":scale: {scale}\n" if scale else ""
+            body += f"```{{figure}} {ASSETS / name}\n{option}```\n\n"
+        slides.append(f"### 画像 {i}\n\n{body}")
+    return "\n".join(slides)
+
+
+DECKS = {
+    "many": (deck_many, 2000),
+    "paragraphs": (deck_paragraphs, 200),
+    "lists": (deck_lists, 500),
+    "fences": (deck_fences, 100),
+    "links": (deck_links, 500),
+    "figures": (deck_figures, 200),
+}
+
+
+class TimedTable(dict):
+    """ディスパッチ表の各ハンドラを、type ごとに時間と回数を記録するものに包む
+
+    prepare_* （コードブロックのハイライトや画像の読み込み）の時間もその type に含める。
+    """
+
+    def __init__(self, table: main.DispatchTable):
+        super().__init__()
+        self.table = table
+        self.times = collections.Counter()  # type: 秒
+        self.calls = collections.Counter()  # type: visit の回数
+        self.prepares = {
+            token_type: self.timed_prepare(token_type, prepare)
+            for token_type, prepare in table.prepares.items()
+        }
+
+    def timed_prepare(self, token_type: str, prepare):
+        times, perf_counter = self.times, time.perf_counter
+
+        def timed(visitor, token):
+            t = perf_counter()
+            result = yield from prepare(visitor, token)
+            times[token_type] += perf_counter() - t
+            return result
+
+        return timed
+
+    def __missing__(self, token_type: str):
+        visit, depart = self.table[token_type]
+        times, calls = self.times, self.calls
+        perf_counter = time.perf_counter
+
+        def timed_visit(visitor, token):
+            t = perf_counter()
+            visit(visitor, token)
+            times[token_type] += perf_counter() - t
+            calls[token_type] += 1
+
+        def timed_depart(visitor, token):
+            t = perf_counter()
+            depart(visitor, token)
+            times[token_type] += perf_counter() - t
+
+        entry = self[token_type] = (timed_visit, timed_depart)
+        return entry
+
+
+class TimedVisitor(main.Visitor):
+    table: TimedTable = None
+
+    @classmethod
+    def dispatch_table(cls):
+        return cls.table
+
+
+def clear_caches():
+    """共有のキャッシュ（ハイライト、コードブロック画像、画像ファイル）を空にする"""
+    main.HIGHLIGHTER = main.Highlighter()
+    main.FENCE_SPRITES = main.SpriteCache(main.FENCE_SPRITE_BUDGET)
+    main.ASSETS = main.AssetCache()
+
+
+def load_deck(app, path: Path):
+    """path のデッキを app に読み込み、キャッシュを空にする"""
+    app.first_pages_in_section = []
+    app.slides = app.load_slides(path)
+    app.display_lists = {}
+    app.render_bank = main.RenderBank()
+    app.prerenderer = main.Prerenderer(app)
+
+
+def summarize(times: list[float]) -> dict:
+    return {
+        "total_ms": round(sum(times), 3),
+        "mean_ms": round(statistics.mean(times), 4),
+        "median_ms": round(statistics.median(times), 4),
+        "max_ms": round(max(times), 4),
+    }
+
+
+def bench_deck(app, name: str, path: Path) -> dict:
+    load_deck(app, path)
+    slides = app.slides
+    tokens = sum(
+        len(s.tokens) + sum(len(t.children or ()) for t in s.tokens) for s in slides
+    )
+
+    layout = []
+    clear_caches()
+    for page, slide in enumerate(slides):
+        t = time.perf_counter()
+        main.Visitor(app, page).walk(slide.tokens)
+        layout.append((time.perf_counter() - t) * 1000)
+
+    render, replay = [], []
+    for times in (render, replay):
+        app.render_bank = main.RenderBank()
+        if times is render:
+            app.display_lists = {}
+            clear_caches()
+        for page in range(len(slides)):
+            t = time.perf_counter()
+            app.render_page(page)
+            times.append((time.perf_counter() - t) * 1000)
+
+    TimedVisitor.table = TimedTable(main.Visitor.dispatch_table())
+    clear_caches()
+    for page, slide in enumerate(slides):
+        TimedVisitor(app, page).walk(slide.tokens)
+    total = sum(TimedVisitor.table.times.values()) or 1
+    token_types = {
+        t: {
+            "ms": round(sec * 1000, 3),
+            "share": round(sec / total, 4),
+            "calls": TimedVisitor.table.calls[t],
+        }
+        for t, sec in TimedVisitor.table.times.most_common()
+    }
+
+    # layout_page と同じく DisplayList を作って保持し、その大きさも確保量に含める
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    display_lists = []
+    for page, slide in enumerate(slides):
+        visitor = main.Visitor(app, page)
+        visitor.walk(slide.tokens)
+        display_lists.append(visitor.img.build())
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "lineno")
+    allocated = sum(s.size_diff for s in stats if s.size_diff > 0)
+    sites = [
+        {
+            "site": f"{Path(s.traceback[0].filename).name}:{s.traceback[0].lineno}",
+            "kb": round(s.size_diff / 1024, 1),
+            "count": s.count_diff,
+        }
+        for s in stats[:5]
+    ]
+
+    return {
+        "deck": name,
+        "slides": len(slides),
+        "tokens": tokens,
+        "layout": summarize(layout),
+        "render": summarize(render),
+        "replay": summarize(replay),
+        "token_types": token_types,
+        "alloc": {
+            "peak_kb": round(peak / 1024, 1),
+            "net_kb": round(allocated / 1024, 1),
+            "per_slide_kb": round(allocated / 1024 / len(slides), 2),
+            "top_sites": sites,
+        },
+    }
+
+
+def report(result: dict, top: int):
+    print(
+        f"deck {result['deck']}: {result['slides']} slides, {result['tokens']} tokens"
+    )
+    for phase in ("layout", "render", "replay"):
+        r = result[phase]
+        print(
+            f"  {phase:<7} total {r['total_ms']:9.1f} ms, {r['mean_ms']:8.3f} ms/slide "
+            f"(median {r['median_ms']:.3f}, max {r['max_ms']:.3f})"
+        )
+    a = result["alloc"]
+    print(
+        f"  alloc   peak {a['peak_kb']:,.0f} KB, retained {a['net_kb']:,.0f} KB "
+        f"({a['per_slide_kb']:.1f} KB/slide)"
+    )
+    for s in a["top_sites"]:
+        print(f"          {s['site']:<24} {s['kb']:10,.1f} KB {s['count']:8} blocks")
+    print(f"  token types (top {top}):")
+    for t, r in list(result["token_types"].items())[:top]:
+        per_call = r["ms"] / r["calls"] if r["calls"] else 0
+        print(
+            f"    {t:<18} {r['ms']:9.1f} ms {r['share']:6.1%} "
+            f"{r['calls']:7} calls {per_call * 1000:8.1f} us/call"
+        )
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    choices = ["slide-ja", *DECKS]
+    parser.add_argument("--deck", action="append", choices=choices)
+    parser.add_argument("--scale", type=float, default=1.0, help="スライド数の倍率")
+    parser.add_argument("--top", type=int, default=8, help="表示する type の数")
+    parser.add_argument("--json", help="結果をJSONで保存")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        main.CACHE_DIR = Path(tmp) / ".cache"
+        app = main.App(run=False)
+        for name in args.deck or choices:
+            if name == "slide-ja":
+                path = APP_DIR / main.MD_FILENAME
+            else:
+                generate, count = DECKS[name]
+                path = Path(tmp) / f"bench-{name}.md"
+                path.write_text(
+                    generate(max(1, int(count * args.scale))), encoding="utf-8"
+                )
+            result = bench_deck(app, name, path)
+            report(result, args.top)
+            results.append(result)
+    if args.json:
+        (CWD / args.json).write_text(json.dumps(results, indent=1))
+        print("saved:", args.json)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,258 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#     "markdown-it-py",
+#     "linkify-it-py",
+#     "pygments",
+#     "pillow",
+#     "pyxel",
+# ]
+# ///
+"""デッキを画面なしでレンダリングして書き出す
+
+App, Visitor, render_page をそのまま使い、スライドの範囲をプロセスプールで分担して
+スライドごとのPNGを書き出す。オプションでPDFにまとめ、ページ切替と子アプリのGIFも作る。
+
+    uv run make.py export [--out dist/export] [--jobs N] [--pages 3-10] [--pdf] [--gif]
+"""
+
+import argparse
+import concurrent.futures
+import json
+import math
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# SDLのdummyドライバはOpenGLが使えずpyxelが起動しないので、offscreenを使う
+os.environ.setdefault("SDL_VIDEODRIVER", "offscreen")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+CWD = Path.cwd()
+APP_DIR = Path(__file__).resolve().parent / "pyxel-slide"
+os.chdir(APP_DIR)
+sys.path.insert(0, str(APP_DIR))
+
+import pyxel  # noqa: E402
+
+import main  # noqa: E402
+
+FPS = 30  # GIFのフレームレート（pyxel.init の既定値と同じ）
+CHILD_GIF_FRAMES = 60  # 子アプリのGIFのフレーム数
+CHUNKS_PER_JOB = 4  # 1プロセスあたりに分けるスライド範囲の数（負荷の偏りを減らす）
+
+_app = None  # プロセスごとのApp
+_startup_ms = 0.0
+
+
+def init_worker():
+    global _app, _startup_ms
+    # App や子アプリが出す表示（読み込みの報告など）は捨てる。エラーは stderr に出る
+    sys.stdout = open(os.devnull, "w")
+    t = time.perf_counter()
+    _app = main.App(run=False)
+    _startup_ms = (time.perf_counter() - t) * 1000
+
+
+def page_count() -> int:
+    return len(_app.slides)
+
+
+def capture(app) -> pyxel.Image:
+    """スライドと子アプリを画面に描画し、スライドの部分を切り出す"""
+    pyxel.cls(7)
+    app.blt_slide()
+    app.blt_child()
+    img = pyxel.Image(main.WIDTH, main.HEIGHT)
+    img.blt(
+        0,
+        0,
+        pyxel.screen,
+        main.WINDOW_PADDING,
+        main.WINDOW_PADDING,
+        main.WIDTH,
+        main.HEIGHT,
+    )
+    return img
+
+
+def save_gif(frames: list[pyxel.Image], path: Path, scale: int):
+    from PIL import Image
+
+    palette = [v for c in pyxel.colors for v in (c >> 16, (c >> 8) & 0xFF, c & 0xFF)]
+    images = []
+    for frame in frames:
+        im = Image.frombytes("P", (frame.width, frame.height), bytes(frame.data_ptr()))
+        im.putpalette(palette)
+        if scale != 1:
+            im = im.resize((frame.width * scale, frame.height * scale), Image.NEAREST)
+        images.append(im)
+    images[0].save(
+        path,
+        save_all=True,
+        append_images=images[1:],
+        duration=1000 // FPS,
+        loop=0,
+        optimize=False,
+    )
+
+
+def record_transition(app, page: int) -> list[pyxel.Image]:
+    """page - 1 から page への切替アニメーションを記録する
+
+    App.page の setter と同じ切替の状態を直接作る（前のページには移らないので、
+    そのページの子アプリは読み込まない）。
+    """
+    app.page = page
+    app.in_transition = [1.0, page - 1, main.DIRECTION_MAP["f", app.slides[page].level]]
+    frames = []
+    while app.in_transition[0] > 0:
+        frames.append(capture(app))
+        app.in_transition[0] -= 3 / FPS  # App.update と同じ速さ
+    app.in_transition[0] = 0
+    frames.append(capture(app))
+    return frames
+
+
+def record_child(app, page: int) -> list[pyxel.Image]:
+    """子アプリを CHILD_GIF_FRAMES フレーム動かして記録する（入力なし）"""
+    a = app.children[page]
+    frames = []
+    for _ in range(CHILD_GIF_FRAMES):
+        a.update()
+        frames.append(capture(app))
+    return frames
+
+
+def export_pages(pages: range, out_dir: Path, scale: int, gif: bool):
+    """pages を書き出し、(pid, 起動時間, [スライドごとの結果]) を返す
+
+    ms はスライドの描画と切り出し・保存の時間、gif_ms は GIF を書いたときだけ入れる。
+    """
+    app = _app
+    results = []
+    for page in pages:
+        t = time.perf_counter()
+        app.page = page  # 描画はここ（同じページのままなら描画済み）
+        app.in_transition[0] = 0
+        stem = out_dir / f"slide-{page:03d}"
+        capture(app).save(str(stem), scale)
+        files = [stem.with_suffix(".png").name]
+        result = {"page": page, "ms": round((time.perf_counter() - t) * 1000, 3)}
+
+        t = time.perf_counter()
+        if gif and page > 0:
+            path = out_dir / f"slide-{page:03d}-transition.gif"
+            save_gif(record_transition(app, page), path, scale)
+            files.append(path.name)
+        if gif and page in app.children:
+            path = out_dir / f"slide-{page:03d}-child.gif"
+            save_gif(record_child(app, page), path, scale)
+            files.append(path.name)
+        if len(files) > 1:
+            result["gif_ms"] = round((time.perf_counter() - t) * 1000, 3)
+        result["files"] = files
+        results.append(result)
+    return os.getpid(), _startup_ms, results
+
+
+def save_pdf(pngs: list[Path], path: Path):
+    from PIL import Image
+
+    images = [Image.open(p).convert("RGB") for p in pngs]
+    images[0].save(path, save_all=True, append_images=images[1:])
+
+
+def parse_pages(spec: str | None, count: int) -> range:
+    """--pages の "3-10" や "5" を range にする（空や範囲外なら ValueError）"""
+    if not spec:
+        if count == 0:
+            raise ValueError("the deck has no slides")
+        return range(count)
+    first, _, last = spec.partition("-")
+    try:
+        first, last = int(first), int(last or first)
+    except ValueError:
+        raise ValueError(f"invalid page range: {spec!r}") from None
+    if first > last:
+        raise ValueError(f"empty page range: {spec!r}")
+    if first < 0 or last >= count:
+        raise ValueError(f"page range {spec!r} is outside the deck (0-{count - 1})")
+    return range(first, last + 1)
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", default="dist/export", help="出力先ディレクトリ")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--pages", help="書き出すページ範囲 (例: 3-10)")
+    parser.add_argument("--scale", type=int, default=1, help="画像の拡大率")
+    parser.add_argument("--pdf", action="store_true", help="PNGをPDFにまとめる")
+    parser.add_argument("--gif", action="store_true", help="切替と子アプリのGIFも作る")
+    args = parser.parse_args()
+    out_dir = (CWD / args.out).resolve()
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    ctx = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(
+        args.jobs, mp_context=ctx, initializer=init_worker
+    ) as pool:
+        try:
+            pages = parse_pages(args.pages, pool.submit(page_count).result())
+        except ValueError as e:
+            parser.error(str(e))
+        size = max(1, math.ceil(len(pages) / (args.jobs * CHUNKS_PER_JOB)))
+        chunks = [pages[i : i + size] for i in range(0, len(pages), size)]
+        futures = [
+            pool.submit(export_pages, chunk, out_dir, args.scale, args.gif)
+            for chunk in chunks
+        ]
+        startups, slides = {}, []
+        for future in futures:
+            pid, startup_ms, results = future.result()
+            startups[pid] = startup_ms
+            slides.extend(results)
+    wall = time.perf_counter() - start
+
+    if args.pdf:
+        t = time.perf_counter()
+        save_pdf([out_dir / s["files"][0] for s in slides], out_dir / "slides.pdf")
+        print(f"pdf: {out_dir / 'slides.pdf'} ({(time.perf_counter() - t):.2f} s)")
+        wall = time.perf_counter() - start
+
+    times = [s["ms"] for s in slides]
+    slowest = sorted(slides, key=lambda s: s["ms"], reverse=True)[:5]
+    summary = {
+        "slides": len(slides),
+        "jobs": args.jobs,
+        "wall_s": round(wall, 3),
+        "worker_startup_ms": round(statistics.mean(startups.values()), 3),
+        "slide_ms": {
+            "mean": round(statistics.mean(times), 3),
+            "median": round(statistics.median(times), 3),
+            "max": max(times),
+            "total": round(sum(times), 3),
+        },
+        "pages": slides,
+    }
+    (out_dir / "summary.json").write_text(json.dumps(summary, indent=2))
+
+    print(
+        f"exported {len(slides)} slides to {out_dir} "
+        f"with {len(startups)} workers in {wall:.2f} s"
+    )
+    print(f"  worker startup: {summary['worker_startup_ms']:.0f} ms (mean)")
+    print(
+        f"  per slide: mean {summary['slide_ms']['mean']:.1f} ms, "
+        f"median {summary['slide_ms']['median']:.1f} ms, "
+        f"max {summary['slide_ms']['max']:.1f} ms"
+    )
+    print("  slowest:", ", ".join(f"p{s['page']} {s['ms']:.1f} ms" for s in slowest))
+
+
+if __name__ == "__main__":
+    run()
@@ -5,39 +5,244 @@
 #     "sphinx==8.*",
 #     "myst-parser[linkify]==4.*",
 #     "click",
+#     "numpy",
+#     "pillow",
 # ]
 # ///
+import ast
+import hashlib
+import re
 import subprocess
 import shutil
+import sys
 from pathlib import Path
 
 import click
 
 PACKAGE_NAME = "pyxel-slide"
+sys.path.insert(0, str(Path(__file__).resolve().parent / PACKAGE_NAME))
 
+from pxi_format import PXI_HEADER, PXI_MAGIC  # noqa: E402
 
-@click.command()
-def run():
-    """Pixelアプリを実行"""
+SLIDE_WIDTH = 384  # main.py の WIDTH（画像の scale 省略時の基準）
+
+# Pyxelのデフォルトパレット
+PYXEL_PALETTE = [
+    0x000000, 0x2B335F, 0x7E2072, 0x19959C, 0x8B4852, 0x395C98, 0xA9C1FF, 0xEEEEEE,
+    0xD4186C, 0xD38441, 0xE9C35B, 0x70C6A9, 0x7696DE, 0xA3A3A3, 0xFF9798, 0xEDC7B0,
+]  # fmt: skip
+
+BAYER_4X4 = [[0, 8, 2, 10], [12, 4, 14, 6], [3, 11, 1, 9], [15, 7, 13, 5]]
+DITHER_STRENGTH = 32  # ディザで加える揺らぎの幅（RGB各256段階中）
+
+figure_pattern = re.compile(r"^```\{figure\}[ \t]+(\S+)[ \t]*\n((?::\w+: .+\n)*)", re.M)
+figure_option_pattern = re.compile(r":(\w+): (.+)")
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.argument("args", nargs=-1, type=click.UNPROCESSED)
+def run(args):
+    """Pixelアプリを実行 (引数は main.py に渡す)"""
     # カレントディレクトリをPACKAGE_NAMEに変更して実行する
-    subprocess.run(["uv", "run", "main.py"], cwd=PACKAGE_NAME)
+    subprocess.run(["uv", "run", "main.py", *args], cwd=PACKAGE_NAME)
+
+
+def collect_codepoints(app_dir: Path) -> set[int]:
+    """デッキ内で表示されうる文字のコードポイントを集める
+
+    - Markdown (スライド本文) と JSON (子アプリのデータ) の全文字
+    - Pythonソース (main.py, 子アプリ) の文字列リテラル
+    - コードや番号付き箇条書き、数値表示用に ASCII 印字可能文字はすべて
+    """
+    texts = ["".join(chr(c) for c in range(0x20, 0x7F))]
+    for path in sorted(app_dir.rglob("*")):
+        if path.suffix in (".md", ".json"):
+            texts.append(path.read_text(encoding="utf-8"))
+        elif path.suffix == ".py":
+            tree = ast.parse(path.read_text(encoding="utf-8"))
+            texts.extend(
+                node.value
+                for node in ast.walk(tree)
+                if isinstance(node, ast.Constant) and isinstance(node.value, str)
+            )
+    return {ord(c) for text in texts for c in text}
+
+
+def subset_bdf(path: Path, codepoints: set[int]):
+    """BDFフォントを codepoints に含まれるグリフだけに絞って上書きする"""
+    header, glyphs, footer = [], [], []
+    glyph = None
+    for line in path.read_text(encoding="latin-1").splitlines(keepends=True):
+        if glyph is not None:
+            glyph.append(line)
+            if line.startswith("ENDCHAR"):
+                glyphs.append(glyph)
+                glyph = None
+        elif line.startswith("STARTCHAR"):
+            glyph = [line]
+        elif glyphs:
+            footer.append(line)
+        else:
+            header.append(line)
+
+    keep = set(codepoints)
+    for line in header:
+        if line.startswith("DEFAULT_CHAR"):
+            keep.add(int(line.split()[1]))  # 未定義文字の代替グリフは残す
+
+    def encoding(glyph):
+        for line in glyph:
+            if line.startswith("ENCODING"):
+                return int(line.split()[1])
+
+    glyphs = [g for g in glyphs if encoding(g) in keep]
+    header = [f"CHARS {len(glyphs)}\n" if l.startswith("CHARS ") else l for l in header]
+    path.write_text(
+        "".join(header + [l for g in glyphs for l in g] + footer), encoding="latin-1"
+    )
+
+
+def subset_fonts(app_dir: Path):
+    """app_dir/assets 以下のBDFフォントをデッキで使う文字だけにサブセット化する"""
+    codepoints = collect_codepoints(app_dir)
+    total_before = total_after = 0
+    for path in sorted((app_dir / "assets").glob("*.bdf")):
+        before = path.stat().st_size
+        subset_bdf(path, codepoints)
+        after = path.stat().st_size
+        total_before += before
+        total_after += after
+        print(f"subset {path.name}: {before / 1024:,.0f} KB -> {after / 1024:,.0f} KB")
+    if total_before:
+        print(
+            f"subset total ({len(codepoints)} chars): "
+            f"{total_before / 1024:,.0f} KB -> {total_after / 1024:,.0f} KB "
+            f"({1 - total_after / total_before:.1%} smaller)"
+        )
+
+
+def collect_figures(app_dir: Path) -> dict[Path, str | None]:
+    """スライドの {figure} で使っている画像と scale オプションを集める
+
+    ワイルドカード (file.*) は main.py と同じく .py があればアプリなので対象外、
+    なければ .png, .jpg の順に選ぶ。同じ画像が複数の scale で使われていたら最初のもの。
+    """
+    figures = {}
+    for md in sorted(app_dir.glob("*.md")):
+        for m in figure_pattern.finditer(md.read_text(encoding="utf-8")):
+            path = md.parent / m[1]
+            options = dict(figure_option_pattern.findall(m[2]))
+            if path.suffix == ".*":
+                matches = {p.suffix: p for p in sorted(path.parent.glob(path.name))}
+                if ".py" in matches:
+                    continue
+                path = matches.get(".png") or matches.get(".jpg")
+            if path is None or path.suffix not in (".png", ".jpg"):
+                continue
+            if path.exists():
+                figures.setdefault(path, options.get("scale"))
+    return figures
+
+
+def quantize(rgb, dither: bool):
+    """RGB画像 (h, w, 3) をPyxelのパレット番号 (h, w) に減色する"""
+    import numpy as np
+
+    palette = np.array(
+        [[(c >> 16) & 0xFF, (c >> 8) & 0xFF, c & 0xFF] for c in PYXEL_PALETTE],
+        dtype=np.int32,
+    )
+    rgb = rgb.astype(np.int32)
+    if dither:
+        h, w = rgb.shape[:2]
+        bayer = (np.array(BAYER_4X4, dtype=np.int32) * 2 + 1 - 16) * DITHER_STRENGTH
+        threshold = np.tile(bayer, (h // 4 + 1, w // 4 + 1))[:h, :w] // 32
+        rgb = rgb + threshold[:, :, None]
+    # 最も近いパレット色（RGBのユークリッド距離）
+    dist = ((rgb[:, :, None, :] - palette[None, None, :, :]) ** 2).sum(axis=3)
+    return dist.argmin(axis=2).astype(np.uint8)
+
+
+def write_pxi(src: Path, scale_option: str | None, dither: bool) -> Path:
+    """画像を slide 上の大きさに最近傍法で拡大縮小・減色して .pxi に書き出す"""
+    import numpy as np
+    from PIL import Image
+
+    data = src.read_bytes()
+    with Image.open(src) as im:
+        rgb = np.asarray(im.convert("RGB"))
+    src_h, src_w = rgb.shape[:2]
+    if scale_option is not None:
+        scale = int(scale_option) / 100
+    else:
+        scale = SLIDE_WIDTH / max(src_w, SLIDE_WIDTH)
+    w, h = max(round(src_w * scale), 1), max(round(src_h * scale), 1)
+
+    # 出力ピクセルの中心に対応する元画像のピクセルを選ぶ
+    xs = np.minimum(((np.arange(w) + 0.5) / scale).astype(np.int64), src_w - 1)
+    ys = np.minimum(((np.arange(h) + 0.5) / scale).astype(np.int64), src_h - 1)
+    indices = quantize(rgb[ys][:, xs], dither)
+
+    header = PXI_HEADER.pack(
+        PXI_MAGIC, src_w, src_h, w, h, scale, hashlib.sha1(data).digest()
+    )
+    out = src.with_name(src.name + ".pxi")
+    out.write_bytes(header + indices.tobytes())
+    return out
+
+
+def preprocess_images(app_dir: Path, dither: bool = False):
+    """{figure} の画像を .pxi に変換する（main.py は .pxi があればそちらを使う）"""
+    for src, scale_option in collect_figures(app_dir).items():
+        out = write_pxi(src, scale_option, dither)
+        print(
+            f"image {src.relative_to(app_dir)} -> {out.name} "
+            f"({out.stat().st_size / 1024:,.0f} KB)"
+        )
+
+
+@click.command()
+@click.option("--dither/--no-dither", default=False, help="4x4のBayerディザで減色する")
+def images(dither):
+    """スライドの画像を拡大縮小・減色済みの .pxi に変換"""
+    preprocess_images(Path(PACKAGE_NAME), dither)
 
 
 @click.command()
-def package():
+@click.option(
+    "--subset/--no-subset", default=True, help="フォントをデッキで使う文字だけに絞る"
+)
+@click.option(
+    "--images/--no-images", "prescale", default=True, help="画像を .pxi に変換する"
+)
+@click.option("--dither/--no-dither", default=False, help="画像の減色でディザを使う")
+def package(subset, prescale, dither):
     """Pyxelパッケージを作成"""
-    shutil.rmtree(f"./{PACKAGE_NAME}/__pycache__", ignore_errors=True)
-    shutil.rmtree(f"./{PACKAGE_NAME}/assets/__pycache__", ignore_errors=True)
+    # 元のディレクトリは変更せず、ステージングディレクトリで加工してからパッケージ化する
+    stage = Path("build/package")
+    shutil.rmtree(stage, ignore_errors=True)
+    shutil.copytree(
+        PACKAGE_NAME,
+        stage / PACKAGE_NAME,
+        ignore=shutil.ignore_patterns("__pycache__", ".cache"),
+    )
+    if subset:
+        subset_fonts(stage / PACKAGE_NAME)
+    if prescale:
+        preprocess_images(stage / PACKAGE_NAME, dither)
     subprocess.run(
-        ["uvx", "pyxel", "package", PACKAGE_NAME, f"./{PACKAGE_NAME}/main.py"]
+        ["uvx", "pyxel", "package", PACKAGE_NAME, f"{PACKAGE_NAME}/main.py"],
+        cwd=stage,
     )
 
     Path("./dist").mkdir(exist_ok=True, parents=True)
-    shutil.move(f"{PACKAGE_NAME}.pyxapp", f"dist/{PACKAGE_NAME}.pyxapp")
+    shutil.move(stage / f"{PACKAGE_NAME}.pyxapp", f"dist/{PACKAGE_NAME}.pyxapp")
     shutil.copyfile(f"{PACKAGE_NAME}/index.html", "dist/index.html")
     shutil.copyfile(f"{PACKAGE_NAME}/slide-ja.md", "dist/slide-ja.md")
-    if Path(f"./{PACKAGE_NAME}/assets").exists():
-        shutil.copytree(f"./{PACKAGE_NAME}/assets", "dist/assets", dirs_exist_ok=True)
+    if (stage / PACKAGE_NAME / "assets").exists():
+        shutil.copytree(
+            stage / PACKAGE_NAME / "assets", "dist/assets", dirs_exist_ok=True
+        )
 
 
 @click.command()
@@ -63,6 +268,21 @@ def revealjs():
     shutil.copytree(Path("build/revealjs"), "dist/revealjs")
 
 
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.argument("args", nargs=-1, type=click.UNPROCESSED)
+def export(args):
+    """スライドをPNG/PDF/GIFに書き出す (引数は export.py に渡す)"""
+    subprocess.run(["uv", "run", "export.py", *args])
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.argument("name")
+@click.argument("args", nargs=-1, type=click.UNPROCESSED)
+def bench(name, args):
+    """ベンチマークを実行 (benchmarks/NAME.py)"""
+    subprocess.run(["uv", "run", f"benchmarks/{name}.py", *args])
+
+
 @click.group()
 def cli():
     """pyxel-slide 用ユーティリティ。サブコマンドで操作します。"""
@@ -71,7 +291,10 @@ def cli():
 # サブコマンド登録
 cli.add_command(run)
 cli.add_command(package)
+cli.add_command(images)
 cli.add_command(revealjs)
+cli.add_command(export)
+cli.add_command(bench)
 
 if __name__ == "__main__":
     cli()
@@ -83,18 +83,18 @@ class Player:
         self.is_falling = False
         self.frame_count = 0
 
-    def update(self):
+    def update(self, keys):
         self.frame_count = pyxel.frame_count
         global scroll_x
         last_y = self.y
-        if pyxel.btn(pyxel.KEY_LEFT):
-            self.dx = -1 * (2 if pyxel.btn(pyxel.KEY_SHIFT) else 1)
+        if keys.btn(pyxel.KEY_LEFT):
+            self.dx = -1 * (2 if keys.btn(pyxel.KEY_SHIFT) else 1)
             self.direction = -1
-        if pyxel.btn(pyxel.KEY_RIGHT):
-            self.dx = 1 * (2 if pyxel.btn(pyxel.KEY_SHIFT) else 1)
+        if keys.btn(pyxel.KEY_RIGHT):
+            self.dx = 1 * (2 if keys.btn(pyxel.KEY_SHIFT) else 1)
             self.direction = 1
         self.dy = min(self.dy + 1, 3)
-        if pyxel.btnp(pyxel.KEY_SPACE):
+        if keys.btnp(pyxel.KEY_SPACE):
             if self.dy == 3 and not self.is_falling:  # 落下3で落ちていない状態
                 self.dy = -7
         self.x, self.y = push_back(self.x, self.y, self.dx, self.dy)
@@ -153,18 +153,26 @@ class App:
 
         global player
         player = Player(0, 30, self.img)
+        self.updates = 0
+        self.input = pyxel  # ボタンの入力 (btn, btnp など)。親アプリが差し替える
+
+    @property
+    def render_version(self):
+        """表示内容が変わったら変わる値（同じなら親アプリは前回の render() 結果を使う）"""
+        return self.updates
 
     def update(self):
         global is_loose, show_bb, is_pback
-        if pyxel.btnp(pyxel.KEY_1):
+        self.updates += 1
+        if self.input.btnp(pyxel.KEY_1):
             show_bb = not show_bb
-        elif pyxel.btnp(pyxel.KEY_2):
+        elif self.input.btnp(pyxel.KEY_2):
             is_loose = not is_loose
-        elif pyxel.btnp(pyxel.KEY_3):
+        elif self.input.btnp(pyxel.KEY_3):
             is_pback = not is_pback
-        elif pyxel.btnp(pyxel.KEY_4):
+        elif self.input.btnp(pyxel.KEY_4):
             game_over()
-        player.update()
+        player.update(self.input)
 
     def render(self):
         g = self.img
@@ -50,8 +50,8 @@ class Word:
     def __len__(self) -> int:
         return len(self.text) + 1  # 単語の文字数と区切りのスペース
 
-    def test_input(self) -> tuple[bool | None, bool]:
-        """入力文字が正しいか判定
+    def test_input(self, keys) -> tuple[bool | None, bool]:
+        """入力文字が正しいか判定（keys は btnp を持つもの。pyxel など）
 
         戻り値:
         - (入力が正しいか, 入力が最後まで完了したか)
@@ -69,12 +69,12 @@ class Word:
         ch = self.text[self.typed_pos]
         correct: bool | None = None  # None: 未入力, False: タイプミス, True: 正解
         for c in range(ord("a"), ord("z") + 1):
-            if ch == chr(c) and pyxel.btnp(c):
+            if ch == chr(c) and keys.btnp(c):
                 # 正解
                 correct = True
                 self.typed_pos += 1
                 break
-            elif pyxel.btnp(c):
+            elif keys.btnp(c):
                 # タイプミス
                 correct = False
                 break
@@ -149,11 +149,11 @@ class WordSet:
     def is_finished(self) -> bool:
         return self.word_pos >= len(self.words)
 
-    def test_input(self) -> tuple[bool | None, bool]:
+    def test_input(self, keys) -> tuple[bool | None, bool]:
         if self.is_finished:
             return None, False
 
-        corr, comp = self.words[self.word_pos].test_input()
+        corr, comp = self.words[self.word_pos].test_input(keys)
         if comp:
             self.word_pos += 1
         return corr, comp
@@ -184,6 +184,8 @@ class App:
         self.height = height
         self.img = pyxel.Image(width, height)
         pyxel.load("assets/res.pyxres")
+        self.updates = 0  # 表示に影響する更新の回数
+        self.input = pyxel  # ボタンの入力 (btnp など)。親アプリが差し替える
         self.reset()
 
     def reset(self):
@@ -199,14 +201,23 @@ class App:
 
     def start(self):
         self.started = True
+        self.updates += 1
 
     def finish(self):
         self.started = False
+        self.updates += 1
+
+    @property
+    def render_version(self):
+        """表示内容が変わったら変わる値（同じなら親アプリは前回の render() 結果を使う）"""
+        if self.started:
+            return self.updates, None
+        return self.updates, pyxel.frame_count // 3  # 開始前は文字色が変わる
 
     def update(self):
         if not self.started:
             # スタートしていない
-            if pyxel.btnp(pyxel.KEY_SPACE):
+            if self.input.btnp(pyxel.KEY_SPACE):
                 # スペースで開始
                 self.reset()
                 self.start()
@@ -219,8 +230,9 @@ class App:
             return
 
         self.time = time.time() - self.start_time
+        self.updates += 1
 
-        correct, complete = self.wordset.test_input()
+        correct, complete = self.wordset.test_input(self.input)
         match correct:
             case True:
                 # 正解
@@ -15,21 +15,35 @@
 # ]
 # ///
 
+import argparse
+import array
 import asyncio
+import collections
+import collections.abc
 import contextlib
 import dataclasses
+import hashlib
 import itertools
+import json
+import marshal
+import math
+import platform
 import re
 import sys
 import time
+import tracemalloc
+import weakref
 import webbrowser
 from pathlib import Path
 
 import pyxel
 
+from pxi_format import PXI_HEADER, PXI_MAGIC
+
 
 TITLE = "Pyxelで作るレトロプレゼンスライド"
 MD_FILENAME = "slide-ja.md"
+CACHE_DIR = Path(".cache")  # 生成物のキャッシュ（消しても再生成される）
 # DEBUG = True
 DEBUG = False
 
@@ -42,22 +56,240 @@ HEIGHT = DEFAULT_LINE_HEIGHT * LINE_NUMS
 WIDTH = HEIGHT * 16 // 9
 KEY_REPEAT = 1  # for 30fps
 KEY_HOLD = 15  # for 30fps
+RENDER_BANK_SIZE = 8  # レンダリング済みページを保持する枚数（最低2枚）
+# 保持するページ画像の合計バイト数上限（Noneなら枚数だけで制限）
+RENDER_BANK_BUDGET = None
+CHILD_APPS_LIMIT = 4  # 生成したまま保持する子アプリの数（最低1つ）
+# 保持する子アプリの画面サイズの合計バイト数上限（Noneなら数だけで制限）
+CHILD_APPS_BUDGET = None
+# 子アプリの update を呼ぶ回数（毎秒）。子アプリに tick_rate があればそちらを使う
+CHILD_TICK_RATE = 30
+CHILD_MAX_TICKS = 3  # 遅れを取り戻すために1フレームで呼ぶ update の上限
+CHILD_UPDATE_BUDGET_MS = 8.0  # 1フレームで子アプリの update に使う時間（ミリ秒）
+# コードブロックの画像キャッシュの合計バイト数上限
+FENCE_SPRITE_BUDGET = WIDTH * HEIGHT * 4
+FENCE_CHUNK = 16  # 先読みでコードブロックを描画するときに1回に進める行数
+PRERENDER_BUDGET_MS = 4.0  # 1フレームで先読みレンダリングに使う時間（ミリ秒）
+HUD_KEY = pyxel.KEY_F1  # 性能表示の切り替え
+HUD_HISTORY = 90  # 性能表示のグラフに残すフレーム数
+WATCH_INTERVAL = 1.0  # --watch でファイルの更新を調べる間隔（秒）
+WATCH_DEBOUNCE = 0.3  # 更新を検出してから、続く更新がないか確かめるまでの時間（秒）
+WATCH_BATCH = 8  # 1回に更新時刻を調べるファイル数
+KINSOKU = False  # 折り返し時に日本語の禁則処理（追い出し）をする
+KINSOKU_NOT_AT_START = frozenset(
+    "、。，．,.)）]］｝」』】〕〉》!！?？:：;；・ーぁぃぅぇぉっゃゅょゎァィゥェォッャュョヮヵヶ…‥"
+)
+KINSOKU_NOT_AT_END = frozenset("(（[［｛「『【〔〈《")
 
 # The Font class only supports BDF format fonts
-font_title = pyxel.Font("assets/b24_b.bdf")
-font_pagetitle = pyxel.Font("assets/b16_b.bdf")
-font_default = pyxel.Font("assets/b12.bdf")
-font_bold = pyxel.Font("assets/b12_b.bdf")
-font_italic = pyxel.Font("assets/b12_i.bdf")
-font_literal = pyxel.Font("assets/b12.bdf")
-FONTS = {
-    "title": font_title,
-    "pagetitle": font_pagetitle,
-    "default": font_default,
-    "strong": font_bold,
-    "em": font_italic,
-    "literal": font_literal,
+FONT_FILES = {
+    "title": "assets/b24_b.bdf",
+    "pagetitle": "assets/b16_b.bdf",
+    "default": "assets/b12.bdf",
+    "strong": "assets/b12_b.bdf",
+    "em": "assets/b12_i.bdf",
+    "literal": "assets/b12.bdf",
 }
+
+
+class StartupProfiler:
+    """起動の各フェーズの時間 (perf_counter) とピークメモリ (tracemalloc) を計測する
+
+    フェーズは入れ子にでき、親のピークメモリには子のピークも含む。
+    tracemalloc が追跡するのはPythonのヒープだけで、pyxel側の確保は含まない。
+    """
+
+    def __init__(self, output: str):
+        self.output = output
+        self.results = []
+        self._stack = []  # [name, start, peak]
+        self.started = time.perf_counter()
+        self.finished = False
+        tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        _, peak = tracemalloc.get_traced_memory()
+        for entry in self._stack:
+            entry[2] = max(entry[2], peak)
+        tracemalloc.reset_peak()
+        entry = [name, time.perf_counter(), 0]
+        self._stack.append(entry)
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            _, peak = tracemalloc.get_traced_memory()
+            self._stack.pop()
+            entry[2] = max(entry[2], peak)
+            for parent in self._stack:
+                parent[2] = max(parent[2], entry[2])
+            self.results.append(
+                {
+                    "phase": name,
+                    "depth": len(self._stack),
+                    "start_ms": round((entry[1] - self.started) * 1000, 3),
+                    "ms": round((end - entry[1]) * 1000, 3),
+                    "peak_kb": round(entry[2] / 1024, 1),
+                }
+            )
+
+    def finish(self):
+        """結果をJSONに書き出して表を表示する"""
+        self.finished = True
+        total_ms = (time.perf_counter() - self.started) * 1000
+        phases = sorted(self.results, key=lambda r: r["start_ms"])
+        content = Path(MD_FILENAME).read_bytes()
+        report = {
+            "deck": MD_FILENAME,
+            "deck_sha1": hashlib.sha1(content).hexdigest(),
+            "python": platform.python_version(),
+            "pyxel": pyxel.VERSION,
+            "total_ms": round(total_ms, 3),
+            "peak_kb": max([r["peak_kb"] for r in phases], default=0.0),
+            "phases": phases,
+        }
+        tracemalloc.stop()
+        Path(self.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+        print(f"{'phase':<40} {'ms':>9} {'peak KB':>9}")
+        for r in phases:
+            name = "  " * r["depth"] + r["phase"]
+            print(f"{name:<40} {r['ms']:9.1f} {r['peak_kb']:9.1f}")
+        print(f"{'total (to first frame)':<40} {total_ms:9.1f}")
+        print("written:", self.output)
+
+
+PROFILER: StartupProfiler | None = None  # --profile-startup のときだけ作る
+
+
+def profile_phase(name: str):
+    """起動プロファイル中ならフェーズとして計測する"""
+    if PROFILER is None or PROFILER.finished:
+        return contextlib.nullcontext()
+    return PROFILER.phase(name)
+
+
+def load_width_table(path: str) -> array.array:
+    """BDFの DWIDTH から BMP 全域の文字幅テーブルを作る
+
+    グリフのない文字の幅は 0 （Font.text_width と同じ）。
+    テーブルはBDFの内容ハッシュをキーに CACHE_DIR に保存し、次回以降はそれを読む。
+    """
+    data = Path(path).read_bytes()
+    digest = hashlib.sha1(data).hexdigest()[:16]
+    cache = CACHE_DIR / "fonts" / f"{Path(path).stem}-{digest}.widths"
+    table = array.array("B")
+    if cache.exists():
+        table.frombytes(cache.read_bytes())
+        if len(table) == 0x10000:
+            return table
+
+    table = array.array("B", bytes(0x10000))
+    code = None
+    for m in re.finditer(rb"^(ENCODING|DWIDTH) (-?\d+)", data, re.MULTILINE):
+        if m[1] == b"ENCODING":
+            code = int(m[2])
+        elif code is not None and 0 <= code < 0x10000:
+            table[code] = min(int(m[2]), 255)
+            code = None
+    with contextlib.suppress(OSError):  # 書き込めない環境ではキャッシュしない
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        cache.write_bytes(table.tobytes())
+    return table
+
+
+class FontMetrics:
+    """フォントの文字幅テーブルと行の高さ
+
+    - 文字幅は array の表引きで求め、文字列ごとの幅はメモ化する
+    - Font.text_width は表の検証と、BMP外の文字にだけ使う
+    """
+
+    PROBE = "Aa0 #.-あア漢●○■▲▼★「」。"  # 検証用の文字列
+    CACHE_SIZE = 4096
+
+    def __init__(self, font: pyxel.Font, path: str):
+        self.font = font
+        self.widths = load_width_table(path)
+        self._text_widths = {}  # text: width
+        if self._measure(self.PROBE) != font.text_width(self.PROBE):
+            print("width table mismatch, fallback to Font.text_width:", path)
+            self._measure = font.text_width
+        self.line_height = self.text_width("あ")  # あの幅を文字の高さとする
+
+    def char_width(self, ch: str) -> int:
+        code = ord(ch)
+        if code < 0x10000:
+            return self.widths[code]
+        return self.font.text_width(ch)
+
+    def char_widths(self, text: str) -> list[int]:
+        try:
+            return list(map(self.widths.__getitem__, map(ord, text)))
+        except IndexError:  # BMP外の文字を含む
+            return list(map(self.char_width, text))
+
+    def _measure(self, text: str) -> int:
+        if "\n" in text:
+            return max(self._measure(line) for line in text.split("\n"))
+        try:
+            return sum(map(self.widths.__getitem__, map(ord, text)))
+        except IndexError:  # BMP外の文字を含む
+            return sum(map(self.char_width, text))
+
+    def text_width(self, text: str) -> int:
+        w = self._text_widths.get(text)
+        if w is None:
+            if len(self._text_widths) >= self.CACHE_SIZE:
+                self._text_widths.clear()
+            w = self._text_widths[text] = self._measure(text)
+            if DEBUG:
+                assert w == self.font.text_width(text), text
+        return w
+
+
+class FontStore(collections.abc.Mapping):
+    """FONTSのキーから pyxel.Font を引くマッピング
+
+    - フォントは初回参照時に読み込む（起動時に全フォントをパースしない）
+    - 同じBDFファイルを指すキー同士は同じ pyxel.Font を共有する
+    - metrics(key) でフォントごとの FontMetrics を返す
+    """
+
+    def __init__(self, files: dict[str, str]):
+        self.files = files
+        self._fonts = {}  # key: Font
+        self._loaded = {}  # path: Font
+        self._metrics = {}  # path: FontMetrics
+
+    def __getitem__(self, key: str) -> pyxel.Font:
+        font = self._fonts.get(key)
+        if font is None:
+            path = self.files[key]
+            font = self._loaded.get(path)
+            if font is None:
+                with profile_phase(f"font {path}"):
+                    font = self._loaded[path] = pyxel.Font(path)
+            self._fonts[key] = font
+        return font
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def metrics(self, key: str) -> FontMetrics:
+        path = self.files[key]
+        m = self._metrics.get(path)
+        if m is None:
+            with profile_phase(f"metrics {path}"):
+                m = self._metrics[path] = FontMetrics(self[key], path)
+        return m
+
+
+FONTS = FontStore(FONT_FILES)
 LIST_MARKERS = ["使用しない", "●", "○", "■", "▲", "▼", "★"]
 
 DIRECTION_MAP = {
@@ -77,7 +309,11 @@ HUMAN_IMAGES = [
 ]
 
 directive_pattern = re.compile(r"^{(.+?)}\s*(.*)$")
+slide_heading_pattern = re.compile(r"^ {0,3}#{1,3}(?:[ \t]|$)")
+fence_pattern = re.compile(r"^ {0,3}(`{3,}|~{3,})")
 directive_option_pattern = re.compile(r":(\w+): (.+)", re.MULTILINE)
+reference_definition_pattern = re.compile(r"^ {0,3}\[[^\]]+\]:", re.MULTILINE)
+reference_label_pattern = re.compile(r"\[([^\[\]]+)\]")
 
 
 @dataclasses.dataclass
@@ -87,6 +323,975 @@ class Slide:
     page: int
     tokens: list
     level: str
+    source: str = ""  # スライドのMarkdownソース
+    digest: str = ""  # source のハッシュ
+
+
+def file_mtime(path) -> int | None:
+    with contextlib.suppress(OSError):
+        return Path(path).stat().st_mtime_ns
+    return None
+
+
+def split_slide_sources(content: str) -> list[str]:
+    """Markdownをスライドの見出し (h1〜h3) の行の直前で分割する
+
+    コードフェンス内の # は見出しとして扱わない。
+    """
+    chunks = []
+    lines = []
+    fence = None
+    for line in content.splitlines(keepends=True):
+        m = fence_pattern.match(line)
+        if fence is None:
+            if m:
+                fence = m[1]
+            elif lines and slide_heading_pattern.match(line):
+                chunks.append("".join(lines))
+                lines = []
+        elif m and m[1][0] == fence[0] and len(m[1]) >= len(fence):
+            fence = None
+        lines.append(line)
+    if lines:
+        chunks.append("".join(lines))
+    return chunks
+
+
+class SlideToken:
+    """Visitor が使う属性だけを持つトークン（markdown_it.token.Token の代わり）"""
+
+    __slots__ = ("type", "tag", "content", "info", "attrs", "map", "children")
+
+    def __init__(self, type, tag, content, info, attrs, map, children):
+        self.type = type
+        self.tag = tag
+        self.content = content
+        self.info = info
+        self.attrs = attrs
+        self.map = map
+        self.children = children
+
+    @classmethod
+    def from_markdown_it(cls, token) -> "SlideToken":
+        children = token.children and [cls.from_markdown_it(c) for c in token.children]
+        return cls(
+            token.type,
+            token.tag,
+            token.content,
+            token.info,
+            dict(token.attrs),
+            token.map and list(token.map),
+            children,
+        )
+
+    def to_tuple(self) -> tuple:
+        children = self.children and tuple(c.to_tuple() for c in self.children)
+        return (
+            self.type,
+            self.tag,
+            self.content,
+            self.info,
+            self.attrs,
+            self.map,
+            children,
+        )
+
+    @classmethod
+    def from_tuple(cls, data: tuple) -> "SlideToken":
+        *fields, children = data
+        children = children and [cls.from_tuple(c) for c in children]
+        return cls(*fields, children)
+
+
+def parser_version() -> str:
+    """パース結果に影響するパッケージのバージョン（markdown_it は import しない）"""
+    import importlib.metadata
+
+    versions = []
+    for dist in ("markdown-it-py", "linkify-it-py"):
+        try:
+            versions.append(f"{dist}=={importlib.metadata.version(dist)}")
+        except importlib.metadata.PackageNotFoundError:
+            versions.append(f"{dist}==?")
+    return ",".join(versions)
+
+
+def normalize_reference(label: str) -> str:
+    """参照リンクのラベルの正規化 (markdown_it.common.utils.normalizeReference と同じ)"""
+    return re.sub(r"\s+", " ", label.strip()).lower().upper()
+
+
+def used_references(source: str, references: dict) -> dict:
+    """references（デッキ全体の参照リンクの定義）のうち source が使い得るもの"""
+    if not references:
+        return {}
+    labels = {normalize_reference(m) for m in reference_label_pattern.findall(source)}
+    return {label: references[label] for label in sorted(labels & references.keys())}
+
+
+class ParseCache:
+    """見出しごとに分割したソース単位のパース結果
+
+    - メモリ上ではソースと使う参照リンクの定義のハッシュごとにトークン列を持つ
+    - 参照リンクの定義は別のスライドにあってもよいので、ソースごとの定義も覚えておく
+    - デッキ全体の分を、デッキの内容ハッシュとパーサーのバージョンをキーにして
+      CACHE_DIR に保存する。保存済みなら markdown_it を import せずに済む
+    """
+
+    FORMAT = 2  # 保存形式を変えたら上げる
+
+    def __init__(self):
+        self.tokens = {}  # key(): [SlideToken, ...]
+        self.references = {}  # ソースのハッシュ: ソースで定義された参照リンク
+        self.md = None
+        self.missed = False  # 保存済みのキャッシュにない部分をパースした
+
+    @staticmethod
+    def digest(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def key(cls, source: str, references: dict) -> str:
+        """source と、source が使う参照リンクの定義のハッシュ（スライドの digest にも使う）"""
+        if not references:
+            return cls.digest(source)
+        return cls.digest(source + "\0" + json.dumps(references, sort_keys=True))
+
+    def _parser(self):
+        if self.md is None:
+            import markdown_it
+
+            self.md = markdown_it.MarkdownIt("gfm-like")
+        return self.md
+
+    def _path(self, filepath, content: str) -> Path:
+        key = self.digest(
+            f"{self.FORMAT}:{sys.implementation.cache_tag}:{parser_version()}:{content}"
+        )
+        return CACHE_DIR / "slides" / f"{Path(filepath).stem}-{key[:16]}.marshal"
+
+    def load(self, filepath, content: str):
+        self.missed = False
+        with contextlib.suppress(OSError, ValueError, EOFError, TypeError):
+            parsed, references = marshal.loads(
+                self._path(filepath, content).read_bytes()
+            )
+            for key, tokens in parsed:
+                self.tokens[key] = [SlideToken.from_tuple(t) for t in tokens]
+            self.references.update(references)
+
+    def save(self, filepath, content: str, keys: list[str]):
+        path = self._path(filepath, content)
+        parsed = [(key, tuple(t.to_tuple() for t in self.tokens[key])) for key in keys]
+        data = (parsed, self.references)
+        with contextlib.suppress(OSError):  # 書き込めない環境ではキャッシュしない
+            path.parent.mkdir(parents=True, exist_ok=True)
+            for old in path.parent.glob(f"{Path(filepath).stem}-*.marshal"):
+                old.unlink()
+            path.write_bytes(marshal.dumps(data))
+
+    def definitions(self, source: str) -> dict:
+        """source で定義されている参照リンク (markdown_it の env["references"])"""
+        if not reference_definition_pattern.search(source):
+            return {}
+        digest = self.digest(source)
+        references = self.references.get(digest)
+        if references is None:
+            env = {}
+            self._parser().parse(source, env)
+            references = self.references[digest] = env.get("references", {})
+            self.missed = True
+        return references
+
+    def parse(self, source: str, references: dict) -> list[SlideToken]:
+        """references（source が使う参照リンクの定義）を env に入れてパースする"""
+        key = self.key(source, references)
+        tokens = self.tokens.get(key)
+        if tokens is None:
+            env = {"references": dict(references)}
+            parsed = self._parser().parse(source, env)
+            tokens = [SlideToken.from_markdown_it(t) for t in parsed]
+            self.tokens[key] = tokens
+            self.missed = True
+        return tokens
+
+
+@dataclasses.dataclass(frozen=True)
+class DisplayList:
+    """1スライド分のレイアウト結果
+
+    - ops: pyxel.Image の描画メソッド呼び出し (method, args, kwargs) の並び
+    - links: リンク領域 (x1, y1, x2, y2, url)
+    - children: 子アプリの配置 (x, y, width, height, filename, scale)
+    - deps: 参照しているファイルとその更新時刻 (path, mtime)
+    """
+
+    ops: tuple
+    links: tuple
+    children: tuple
+    deps: tuple = ()
+
+    def is_stale(self) -> bool:
+        """参照しているファイルが更新されていれば True"""
+        return any(file_mtime(path) != mtime for path, mtime in self.deps)
+
+    def replay(
+        self, img: pyxel.Image, start: int = 0, deadline: float | None = None
+    ) -> int:
+        """ops[start:] を img に描画し、次に描画する位置を返す
+
+        deadline (time.perf_counter の値) を過ぎたら途中で止める。
+        """
+        ops = self.ops
+        for i in range(start, len(ops)):
+            if deadline is not None and time.perf_counter() > deadline:
+                return i
+            method, args, kwargs = ops[i]
+            method(img, *args, **kwargs)
+        return len(ops)
+
+
+class DisplayListBuilder:
+    """pyxel.Image の代わりに描画呼び出しを記録して DisplayList を作る"""
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.ops = []
+        self.links = []
+        self.children = []
+        self.deps = []
+
+    def _recorder(method):
+        def record(self, *args, **kwargs):
+            self.ops.append((method, args, kwargs))
+
+        return record
+
+    rect = _recorder(pyxel.Image.rect)
+    rectb = _recorder(pyxel.Image.rectb)
+    line = _recorder(pyxel.Image.line)
+    text = _recorder(pyxel.Image.text)
+    blt = _recorder(pyxel.Image.blt)
+    del _recorder
+
+    def depend(self, path):
+        self.deps.append((str(path), file_mtime(path)))
+
+    def build(self) -> DisplayList:
+        return DisplayList(
+            tuple(self.ops), tuple(self.links), tuple(self.children), tuple(self.deps)
+        )
+
+
+class RenderBank:
+    """レンダリング済みページ画像のLRUキャッシュ
+
+    容量は枚数 capacity とバイト数 budget の小さい方。ページ切替アニメーションで
+    新旧2ページを使うので最低2枚は保持する。追い出した画像は次のページで再利用する。
+    """
+
+    IMAGE_BYTES = WIDTH * HEIGHT  # 1ピクセル1バイト
+
+    def __init__(
+        self, capacity: int = RENDER_BANK_SIZE, budget: int | None = RENDER_BANK_BUDGET
+    ):
+        if budget is not None:
+            capacity = min(capacity, budget // self.IMAGE_BYTES)
+        self.capacity = max(capacity, 2)
+        self.images = collections.OrderedDict()  # page: Image（最近使ったものが末尾）
+        self.spare = None  # 追い出した画像（再利用する）
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, page: int) -> bool:
+        return page in self.images
+
+    def __len__(self):
+        return len(self.images)
+
+    def get(self, page: int) -> pyxel.Image | None:
+        img = self.images.get(page)
+        if img is not None:
+            self.images.move_to_end(page)
+        return img
+
+    def new_image(self) -> pyxel.Image:
+        """描画用の画像を返す（追い出した画像があれば再利用）"""
+        img, self.spare = self.spare, None
+        return img or pyxel.Image(WIDTH, HEIGHT)
+
+    def put(self, page: int, img: pyxel.Image):
+        """page の画像を登録する（満杯なら最も古いページを追い出す）"""
+        if page not in self.images and len(self.images) >= self.capacity:
+            _, self.spare = self.images.popitem(last=False)
+            self.evictions += 1
+        self.images[page] = img
+        self.images.move_to_end(page)
+
+    def allocate(self, page: int) -> pyxel.Image:
+        """page 用の画像を確保する"""
+        img = self.new_image()
+        self.put(page, img)
+        return img
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "pages": len(self.images),
+            "capacity": self.capacity,
+            "bytes": len(self.images) * self.IMAGE_BYTES,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class SpriteCache:
+    """描画済みの部品画像 (コードブロックなど) のLRUキャッシュ
+
+    key: (image, dx, dy) を持つ。dx, dy は描画後のカーソルの移動量。
+    合計バイト数が budget を超えたら古いものから捨てる。
+    モジュール全体で共有するのでリロード後も変更のない部品は使い回せる。
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.bytes = 0
+        self.sprites = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key) -> bool:
+        return key in self.sprites
+
+    def get(self, key) -> tuple[pyxel.Image, int, int] | None:
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.sprites.move_to_end(key)
+        return sprite
+
+    def put(self, key, sprite: tuple[pyxel.Image, int, int]):
+        """key の画像を入れる（先読みと layout_page で同じものを作った場合は入れ替える）"""
+        old = self.sprites.pop(key, None)
+        if old is not None:
+            self.bytes -= old[0].width * old[0].height
+        image = sprite[0]
+        self.sprites[key] = sprite
+        self.bytes += image.width * image.height
+        while self.bytes > self.budget and len(self.sprites) > 1:
+            _, (old, _, _) = self.sprites.popitem(last=False)
+            self.bytes -= old.width * old.height
+
+
+FENCE_SPRITES = SpriteCache(FENCE_SPRITE_BUDGET)
+
+
+class AssetCache:
+    """{figure} で使うファイルのキャッシュ
+
+    - globs: ワイルドカード (assets/typinggame.*) の解決結果。ディレクトリの更新時刻で判定
+    - images: デコード・減色済みの pyxel.Image と、scale ごとの拡大縮小済み画像。
+      ファイルの更新時刻で判定
+    - pxis: make.py images で作った .pxi。元画像と .pxi の更新時刻で判定
+      （.pxi の方が古ければ元画像のSHA-1で確かめる）
+
+    モジュール全体で共有するのでリロード後も変更のないファイルは読み直さない。
+    """
+
+    def __init__(self):
+        self.globs = {}  # (dir, pattern): (mtime, {ext: path})
+        self.images = {}  # path: (mtime, Image, {scale: scaled})
+        self.pxis = {}  # path: ((mtime, pxi mtime), pxi)
+
+    def glob(self, path: Path, suffixes) -> dict[str, Path]:
+        """path.name のパターンに一致するファイルを拡張子ごとに返す"""
+        key = (str(path.parent.resolve()), path.name)
+        mtime = file_mtime(path.parent)
+        entry = self.globs.get(key)
+        if entry is None or entry[0] != mtime:
+            matches = {}
+            for fname in path.parent.glob(path.name):
+                if fname.suffix in suffixes:
+                    matches[fname.suffix] = fname
+            entry = self.globs[key] = (mtime, matches)
+        return entry[1]
+
+    def _entry(self, path: Path):
+        key = str(path.resolve())
+        mtime = file_mtime(path)
+        entry = self.images.get(key)
+        if entry is None or entry[0] != mtime:
+            entry = self.images[key] = (mtime, pyxel.Image.from_image(str(path)), {})
+        return entry
+
+    def pxi(self, path: Path):
+        """path に対応する .pxi を (image, 元の幅, 元の高さ, scale) で返す
+
+        .pxi がない、または元画像から作ったものでなければ None
+        """
+        pxi_path = path.with_name(path.name + ".pxi")
+        key = str(path.resolve())
+        mtimes = (file_mtime(path), file_mtime(pxi_path))
+        entry = self.pxis.get(key)
+        if entry is None or entry[0] != mtimes:
+            entry = self.pxis[key] = (mtimes, self._load_pxi(path, pxi_path, mtimes))
+        return entry[1]
+
+    @staticmethod
+    def _load_pxi(path: Path, pxi_path: Path, mtimes: tuple):
+        try:
+            data = pxi_path.read_bytes()
+        except OSError:
+            return None
+        if len(data) < PXI_HEADER.size:
+            return None
+        magic, src_w, src_h, w, h, scale, digest = PXI_HEADER.unpack_from(data)
+        pixels = data[PXI_HEADER.size :]
+        if magic != PXI_MAGIC or len(pixels) != w * h:
+            return None
+        src_mtime, pxi_mtime = mtimes
+        if src_mtime is None:
+            return None
+        # 元画像の後に作った .pxi なら元画像は読まない。古ければ内容で比べる (git checkout など)
+        if pxi_mtime < src_mtime:
+            if hashlib.sha1(path.read_bytes()).digest() != digest:
+                print("outdated", pxi_path.name)
+                return None
+        image = pyxel.Image(w, h)
+        image.data_ptr()[:] = pixels
+        return image, src_w, src_h, scale
+
+    def image(self, path: Path) -> pyxel.Image:
+        return self._entry(path)[1]
+
+    def scaled(self, path: Path, scale: float):
+        """scale 倍した画像を (image, u, v, w, h, dx, dy) で返す
+
+        image の (u, v, w, h) の範囲を、元画像を scale 付きで blt したときと同じ
+        位置に (dx, dy) ずらして貼ればよい。描画範囲が空なら None
+        """
+        _, p, variants = self._entry(path)
+        if scale not in variants:
+            variants[scale] = self._prescale(p, scale)
+        return variants[scale]
+
+    @staticmethod
+    def _prescale(p: pyxel.Image, scale: float):
+        w, h = p.width, p.height
+        if scale == 1:
+            return p, 0, 0, w, h, 0, 0
+
+        # blt(x - int(w * (1 - s) / 2), ...) と同じ位置合わせで、余白付きの画像に描く
+        ox, oy = -int(w * (1 - scale) / 2), -int(h * (1 - scale) / 2)
+        pad = 2
+        sw, sh = math.ceil(w * scale) + pad * 2, math.ceil(h * scale) + pad * 2
+        image = pyxel.Image(sw, sh)
+        image.blt(ox + pad, oy + pad, p, 0, 0, w, h, scale=scale)
+
+        # 実際に描かれた範囲を、塗りつぶした画像を同じように描いて調べる
+        solid = pyxel.Image(w, h)
+        solid.rect(0, 0, w, h, 1)
+        mask = pyxel.Image(sw, sh)
+        mask.blt(ox + pad, oy + pad, solid, 0, 0, w, h, scale=scale)
+        cols = [i for i in range(sw) if mask.pget(i, sh // 2)]
+        rows = [j for j in range(sh) if mask.pget(sw // 2, j)]
+        if not cols or not rows:
+            return None
+        u, v = cols[0], rows[0]
+        return image, u, v, cols[-1] - u + 1, rows[-1] - v + 1, u - pad, v - pad
+
+
+ASSETS = AssetCache()
+
+
+class Prerenderer:
+    """アイドル時間に次に表示されそうなページを少しずつレンダリングする
+
+    1フレームあたり budget_ms まで、レイアウト (Visitor.steps) と描画命令の再生を
+    小分けに進める。描画途中の画像はバンクに入れず、完成してから登録する。
+    """
+
+    def __init__(self, app: "App", budget_ms: float = PRERENDER_BUDGET_MS):
+        self.app = app
+        self.budget = budget_ms / 1000
+        self.queue = []  # 先読みするページ
+        # 描画途中のページ [page, img, レイアウト途中の (Visitor, steps) | None,
+        #                   display_list, 次の描画位置]
+        self.job = None
+        self.rendered = 0  # 先読みで完成したページ数
+
+    def schedule(self, pages: list[int]):
+        self.queue = list(pages)
+
+    def step(self):
+        """budget の時間内で先読みを進める"""
+        deadline = time.perf_counter() + self.budget
+        while time.perf_counter() < deadline:
+            if self.job is None and not self._start():
+                return
+            if not self._layout(deadline):
+                return
+            page, img, _, dl, i = self.job
+            i = dl.replay(img, i, deadline)
+            if i < len(dl.ops):
+                self.job[4] = i
+                return
+            self._complete()
+
+    def finish(self, page: int) -> pyxel.Image | None:
+        """page が描画途中なら残りを描画して返す"""
+        if self.job is None or self.job[0] != page:
+            return None
+        self._layout(None)
+        _, img, _, dl, i = self.job
+        dl.replay(img, i)
+        return self._complete()
+
+    def _start(self) -> bool:
+        app = self.app
+        while self.queue:
+            page = self.queue.pop(0)
+            if page not in app.render_bank:
+                img = app.render_bank.new_image()
+                img.rect(0, 0, WIDTH, HEIGHT, 7)
+                slide = app.slides[page]
+                dl = app.display_lists.get(slide.digest)
+                layout = None
+                if dl is None:
+                    visitor = Visitor(app, page)
+                    layout = (visitor, visitor.steps(slide.tokens))
+                self.job = [page, img, layout, dl, 0]
+                return True
+        return False
+
+    def _layout(self, deadline: float | None) -> bool:
+        """レイアウト途中なら deadline まで進める。レイアウトが終わっていれば True"""
+        if self.job[2] is None:
+            return True
+        visitor, steps = self.job[2]
+        visitor.deadline = deadline
+        for _ in steps:
+            if deadline is not None and time.perf_counter() > deadline:
+                return False
+        self.job[2] = None
+        self.job[3] = self.app.add_layout(self.job[0], visitor.img.build())
+        return True
+
+    def _complete(self) -> pyxel.Image:
+        page, img, _, _, _ = self.job
+        self.job = None
+        self.app.render_bank.put(page, img)
+        self.rendered += 1
+        return img
+
+
+class PaletteManager:
+    """pyxel.colors の切替を管理する
+
+    使用中のパレットを覚えておき、違うパレットを使うときだけ書き換える。
+    子アプリのパレットの色がすべて親のパレットにあれば、パレットは切り替えずに
+    描画時の色の置き換え (pyxel.pal) で親のパレットの色として描画する。
+    """
+
+    def __init__(self, colors: list[int]):
+        self.base = tuple(colors)  # 親アプリのパレット
+        self.active = None  # pyxel.colors に設定中のパレット
+        self.swaps = 0
+        self.sync()
+
+    def sync(self):
+        """pyxel.colors が直接書き換えられた後（子アプリの読み込みなど）に呼ぶ"""
+        self.active = tuple(pyxel.colors.to_list())
+
+    def use(self, colors):
+        """colors をパレットに設定する（設定済みなら何もしない）"""
+        colors = tuple(colors)
+        if colors != self.active:
+            pyxel.colors.from_list(list(colors))
+            self.active = colors
+            self.swaps += 1
+
+    def remap_table(self, colors) -> dict[int, int] | None:
+        """colors の色番号を親のパレットの色番号に置き換える表
+
+        同じ番号の置き換えは含まない。親のパレットにない色があれば None
+        """
+        index = {}
+        for i, c in enumerate(self.base):
+            index.setdefault(c, i)
+        if any(c not in index for c in colors):
+            return None
+        return {i: index[c] for i, c in enumerate(colors) if index[c] != i}
+
+
+class ResourceBanks:
+    """pyxel のリソースバンク (images, tilemaps, sounds, musics) を子アプリごとに切り替える
+
+    子アプリの生成前に空のバンクに入れ替え、生成後にそのバンクを覚えておく。
+    pyxel.load はバンクのオブジェクトを置き換えるので、覚えておくのは参照だけでよい。
+    ページを表示したときはバンクを入れ替えるだけで .pyxres を読み直さない。
+    """
+
+    def __init__(self):
+        self.snapshots = weakref.WeakKeyDictionary()  # 子アプリ: バンク
+        self.active = None  # 現在のバンクの子アプリ (weakref)
+        self.swaps = 0
+
+    def fresh(self):
+        """空のバンクに入れ替える（子アプリの生成前に呼ぶ）"""
+        pyxel.images[:] = [pyxel.Image(img.width, img.height) for img in pyxel.images]
+        pyxel.tilemaps[:] = [
+            pyxel.Tilemap(t.width, t.height, 0) for t in pyxel.tilemaps
+        ]
+        pyxel.sounds[:] = [pyxel.Sound() for _ in pyxel.sounds]
+        pyxel.musics[:] = [pyxel.Music() for _ in pyxel.musics]
+        self.active = None
+
+    def capture(self, a):
+        """現在のバンクを a のものとして覚える（子アプリの生成後に呼ぶ）"""
+        self.snapshots[a] = (
+            list(pyxel.images),
+            list(pyxel.tilemaps),
+            list(pyxel.sounds),
+            list(pyxel.musics),
+        )
+        self.active = weakref.ref(a)
+
+    def restore(self, a):
+        """a のバンクに入れ替える"""
+        if self.active is not None and self.active() is a:
+            return
+        snapshot = self.snapshots.get(a)
+        if snapshot is None:
+            return
+        images, tilemaps, sounds, musics = snapshot
+        pyxel.images[:] = images
+        pyxel.tilemaps[:] = tilemaps
+        pyxel.sounds[:] = sounds
+        pyxel.musics[:] = musics
+        self.active = weakref.ref(a)
+        self.swaps += 1
+
+
+class ChildManager:
+    """子アプリの生成・一時停止・破棄を管理する
+
+    - 子アプリはそのページを表示したときに生成する（レンダリングや先読みでは生成しない）
+    - 表示中でなくなった子アプリは止め、suspend() があれば呼ぶ。再表示で resume() を呼ぶ
+    - 数 limit と画面サイズの合計バイト数 budget を超えたら、最近表示していないものから
+      モジュールごと破棄する。次に表示したときに作り直す
+    """
+
+    def __init__(
+        self, app, limit: int = CHILD_APPS_LIMIT, budget: int | None = CHILD_APPS_BUDGET
+    ):
+        self.app = app
+        self.limit = max(limit, 1)
+        self.budget = budget
+        self.apps = collections.OrderedDict()  # page: 子アプリ（最近表示が末尾）
+        self.active = None  # 動いている子アプリのページ
+        self.loads = 0
+        self.unloads = 0
+
+    def __contains__(self, page: int) -> bool:
+        return page in self.apps
+
+    def __getitem__(self, page: int):
+        return self.apps[page]
+
+    def show(self, page: int):
+        """page を表示する。動いていた子アプリを止め、page の子アプリを動かす"""
+        if self.active == page:
+            return
+        self.suspend()
+        children = self.app.layout_page(page).children
+        if not children:
+            return
+        if page in self.apps:
+            self.apps.move_to_end(page)
+            self.app.banks.restore(self.apps[page])
+            if hasattr(self.apps[page], "resume"):
+                self.apps[page].resume()
+        else:
+            self.app.load_child(page, *children[0])
+            self.loads += 1
+        self.active = page
+        self.trim()
+
+    def suspend(self):
+        """動いている子アプリを止める"""
+        if self.active is None:
+            return
+        a = self.apps.get(self.active)
+        self.active = None
+        if a is None:
+            return
+        pyxel.stop()  # 子アプリが鳴らしている音を止める
+        self.app.scheduler.pause(a)
+        if hasattr(a, "suspend"):
+            a.suspend()
+        if report := self.app.scheduler.report(a):
+            print(report)
+
+    def trim(self):
+        """limit と budget に収まるまで、最近表示していない子アプリを破棄する"""
+
+        def nbytes():
+            return sum(a.width * a.height for a in self.apps.values())
+
+        while len(self.apps) > 1 and (
+            len(self.apps) > self.limit
+            or (self.budget is not None and nbytes() > self.budget)
+        ):
+            page = next(p for p in self.apps if p != self.active)
+            self.unload(self.apps.pop(page))
+
+    def unload(self, a):
+        """子アプリのモジュールを破棄する（次の生成で読み込み直す）"""
+        sys.modules.pop(a.__module__, None)
+        self.unloads += 1
+
+    def remap(self, apps: dict, dropped: list):
+        """リロードでページ番号を付け替えた apps に入れ替える"""
+        self.suspend()
+        self.apps = collections.OrderedDict(apps)
+        for a in dropped:
+            self.unload(a)
+
+    def clear(self):
+        self.suspend()
+        for a in self.apps.values():
+            self.unload(a)
+        self.apps.clear()
+
+    def stats(self) -> dict:
+        return {
+            "apps": len(self.apps),
+            "active": self.active,
+            "loads": self.loads,
+            "unloads": self.unloads,
+        }
+
+
+class ChildInput:
+    """子アプリのボタン入力 (pyxel の btn, btnp, btnr と同じ呼び方)
+
+    子アプリが input 属性を持っていれば読み込み時にこれを入れる（単体で動かすときは
+    input = pyxel にしておく）。catching_up の間（同じフレームで2回目以降の update）は
+    btnp, btnr が False を返す。
+    """
+
+    def __init__(self):
+        self.catching_up = False
+
+    def btn(self, *args, **kwargs) -> bool:
+        return pyxel.btn(*args, **kwargs)
+
+    def btnp(self, *args, **kwargs) -> bool:
+        return not self.catching_up and pyxel.btnp(*args, **kwargs)
+
+    def btnr(self, *args, **kwargs) -> bool:
+        return not self.catching_up and pyxel.btnr(*args, **kwargs)
+
+
+@contextlib.contextmanager
+def no_button_presses():
+    """btnp, btnr が常に False を返すようにする（同じフレームで2回目以降の update 用）
+
+    input 属性のない子アプリ用。pyxel モジュールの関数を一時的に置き換えるので、
+    その間は親アプリを含めて全体に効く。例外が起きても元に戻す。
+    """
+    btnp, btnr = pyxel.btnp, pyxel.btnr
+    pyxel.btnp = pyxel.btnr = lambda *args, **kwargs: False
+    try:
+        yield
+    finally:
+        pyxel.btnp, pyxel.btnr = btnp, btnr
+
+
+class ChildTimer:
+    """子アプリごとの更新タイミングと計測値"""
+
+    SMOOTHING = 0.1  # 計測値の指数移動平均の係数
+
+    def __init__(self):
+        self.acc = 0.0  # 未消化の時間（秒）
+        self.last = None  # 前回 tick した時刻。止まっていたら None
+        self.ticks = 0
+        self.dropped = 0  # 上限や予算を超えて捨てた update の回数
+        self.skipped = False  # 前回の tick で予算のため1回も update しなかった
+        self.update_ms = 0.0
+        self.render_ms = 0.0
+
+    def record(self, name: str, ms: float):
+        old = getattr(self, name)
+        setattr(self, name, ms if old == 0 else old + (ms - old) * self.SMOOTHING)
+
+
+class ChildScheduler:
+    """子アプリの update を親のフレームレートと切り離して一定の間隔で呼ぶ
+
+    - 経過時間を貯めておき、tick_rate (任意、なければ rate) 回/秒で update を呼ぶ
+    - 親が遅いときは1フレームで複数回呼んで追いつくが、max_ticks 回と budget_ms までで、
+      それを超える遅れは捨てる（子アプリが遅くなり、親の操作は重くならない）
+    - update の時間の平均で budget_ms を超えそうなら、そのフレームの最初の1回も呼ばない
+      （ただし続けては飛ばさないので、重い子アプリも1フレームおきには動く）
+    - 同じフレームの2回目以降の update では btnp, btnr は False になる
+      (ChildInput。input 属性のない子アプリは no_button_presses)
+    - update と render の時間を子アプリごとに計測する
+    """
+
+    def __init__(
+        self,
+        rate: float = CHILD_TICK_RATE,
+        max_ticks: int = CHILD_MAX_TICKS,
+        budget_ms: float = CHILD_UPDATE_BUDGET_MS,
+    ):
+        self.rate = rate
+        self.max_ticks = max(max_ticks, 1)
+        self.budget_ms = budget_ms
+        self.timers = weakref.WeakKeyDictionary()  # 子アプリ: ChildTimer
+        self.input = ChildInput()  # input 属性を持つ子アプリに渡す
+        self.clock = time.perf_counter  # 経過時間の元（入力の再生では差し替える）
+
+    def timer(self, a) -> ChildTimer:
+        t = self.timers.get(a)
+        if t is None:
+            t = self.timers[a] = ChildTimer()
+        return t
+
+    def tick(self, a, now: float) -> int:
+        """経過時間の分だけ a.update() を呼び、呼んだ回数を返す"""
+        t = self.timer(a)
+        interval = 1 / getattr(a, "tick_rate", self.rate)
+        # 止まっていた後はすぐ1回呼ぶ
+        t.acc += interval if t.last is None else now - t.last
+        t.last = now
+        # 半フレーム分の揺らぎは許容し、毎フレーム1回になるようにする
+        n = int(t.acc / interval + 0.5)
+        if n > self.max_ticks:
+            t.dropped += n - self.max_ticks
+            n = self.max_ticks
+            t.acc = n * interval
+        t.acc -= n * interval
+
+        deadline = time.perf_counter() + self.budget_ms / 1000
+        explicit = getattr(a, "input", None) is self.input
+        try:
+            for i in range(n):
+                start = time.perf_counter()
+                # 平均の update 時間で予算を超えそうならやめる（前回も飛ばしたなら1回は呼ぶ）
+                if start + t.update_ms / 1000 > deadline and (i > 0 or not t.skipped):
+                    t.dropped += n - i
+                    t.skipped = i == 0
+                    return i
+                self.input.catching_up = i > 0
+                if i == 0 or explicit:
+                    a.update()
+                else:
+                    with no_button_presses():
+                        a.update()
+                t.record("update_ms", (time.perf_counter() - start) * 1000)
+                t.ticks += 1
+        finally:
+            self.input.catching_up = False  # 次のフレームや親アプリに持ち越さない
+        t.skipped = False
+        return n
+
+    def pause(self, a):
+        """a を止める（止まっていた時間の分は取り戻さない）"""
+        t = self.timers.get(a)
+        if t is not None:
+            t.acc = 0.0
+            t.last = None
+
+    def render(self, a) -> pyxel.Image:
+        start = time.perf_counter()
+        g = a.render()
+        self.timer(a).record("render_ms", (time.perf_counter() - start) * 1000)
+        return g
+
+    def stats(self, a) -> dict:
+        t = self.timer(a)
+        return {
+            "ticks": t.ticks,
+            "dropped": t.dropped,
+            "update_ms": round(t.update_ms, 3),
+            "render_ms": round(t.render_ms, 3),
+        }
+
+    def report(self, a) -> str | None:
+        t = self.timers.get(a)
+        if t is None or not (t.ticks or t.render_ms):
+            return None
+        return (
+            f"child {type(a).__module__}: update {t.update_ms:.2f} ms, "
+            f"render {t.render_ms:.2f} ms, {t.ticks} ticks ({t.dropped} dropped)"
+        )
+
+
+class FileWatcher:
+    """監視ファイルの更新時刻を定期的に調べ、更新されたファイルを返す
+
+    - interval 秒ごとに、1回の poll で調べるファイルは batch 個までにして、
+      メインループを止めない
+    - 更新を検出したファイルは interval とは別に debounce 秒後に調べ直し、その間に
+      更新がなければ通知する。更新が続いていれば待ち直す（保存中に何度も書き込む
+      エディタで途中の内容を読まないように）
+    """
+
+    def __init__(
+        self,
+        interval: float = WATCH_INTERVAL,
+        debounce: float = WATCH_DEBOUNCE,
+        batch: int = WATCH_BATCH,
+    ):
+        self.interval = interval
+        self.debounce = debounce
+        self.batch = batch
+        self.mtimes = {}  # path: mtime
+        self.pending = {}  # path: 最後に更新を検出した時刻
+        self.cursor = 0
+        self.next_poll = 0.0
+
+    def watch(self, paths):
+        for path in paths:
+            self.mtimes.setdefault(str(path), file_mtime(path))
+
+    def poll(self, now: float) -> set[str]:
+        ready = set()
+        for path in [p for p, t in self.pending.items() if now - t >= self.debounce]:
+            if self._changed(path):
+                self.pending[path] = now  # 更新が続いている間は待ち直す
+            else:
+                del self.pending[path]
+                ready.add(path)
+
+        if now < self.next_poll or not self.mtimes:
+            return ready
+        self.next_poll = now + self.interval
+        paths = list(self.mtimes)
+        self.cursor %= len(paths)
+        batch = paths[self.cursor : self.cursor + self.batch]
+        self.cursor += self.batch
+        for path in batch:
+            if path not in self.pending and self._changed(path):
+                self.pending[path] = now
+        return ready
+
+    def _changed(self, path: str) -> bool:
+        """前回調べたときから更新時刻が変わったか（変わっていれば覚え直す）"""
+        mtime = file_mtime(path)
+        if mtime == self.mtimes[path]:
+            return False
+        self.mtimes[path] = mtime
+        return True
 
 
 class FPS:
@@ -117,6 +1322,75 @@ class FPS:
         return str(self.value)
 
 
+class PerfHud:
+    """HUD_KEY で表示を切り替える性能表示
+
+    表示中だけ update, draw, render_page の時間を計り、非表示のときは何もしない。
+    render_page の時間は App.render_page が表示中だけ record_render で渡す。
+    """
+
+    X = WINDOW_PADDING + 2
+    Y = WINDOW_PADDING + 2
+    GRAPH_HEIGHT = 16
+    FRAME_MS = 1000 / 30  # pyxel.init の既定の fps での1フレームの時間
+
+    def __init__(self, app: "App"):
+        self.app = app
+        self.visible = False
+        self.frames = collections.deque(maxlen=HUD_HISTORY)  # update + draw (ms)
+        self.update_ms = 0.0
+        self.render_ms = 0.0  # 最後にレンダリングしたときの render_page (ms)
+        self.rendered = 0  # 表示中にレンダリングしたページ数
+
+    def toggle(self):
+        self.visible = not self.visible
+        if self.visible:
+            self.frames.clear()
+
+    def record_render(self, ms: float):
+        """バンクになかったページのレンダリング時間を記録する"""
+        self.render_ms = ms
+        self.rendered += 1
+
+    def draw(self, draw_ms: float):
+        app = self.app
+        self.frames.append(self.update_ms + draw_ms)
+        bank = app.render_bank.stats()
+        lines = [
+            f"FPS {app.fps}  update {self.update_ms:.2f}ms  draw {draw_ms:.2f}ms",
+            "",
+            "",
+            "",
+            f"render_page {self.render_ms:.2f}ms ({self.rendered} pages)",
+            f"bank hit {bank['hit_rate']:.0%} "
+            f"({bank['hits']}/{bank['hits'] + bank['misses']}), "
+            f"{bank['pages']}/{bank['capacity']} pages",
+            f"prerendered {app.prerenderer.rendered}",
+        ]
+        if app.page in app.children:
+            child = app.scheduler.stats(app.children[app.page])
+            lines.append(
+                f"child update {child['update_ms']:.2f}ms "
+                f"render {child['render_ms']:.2f}ms ({child['dropped']} dropped)"
+            )
+        width = max(len(line) for line in lines) * pyxel.FONT_WIDTH + 4
+        pyxel.rect(self.X, self.Y, width, len(lines) * pyxel.FONT_HEIGHT + 4, 0)
+        for i, line in enumerate(lines):
+            pyxel.text(self.X + 2, self.Y + 2 + i * pyxel.FONT_HEIGHT, line, 7)
+        self._draw_graph(self.X + 2, self.Y + 2 + pyxel.FONT_HEIGHT + 1)
+
+    def _draw_graph(self, x: int, y: int):
+        """フレーム時間のグラフ（1フレームの時間を超えたら赤）"""
+        peak = max(self.frames)
+        scale = self.GRAPH_HEIGHT / max(peak, 1.0)
+        bottom = y + self.GRAPH_HEIGHT - 1
+        for i, ms in enumerate(self.frames):
+            h = max(int(ms * scale), 1)
+            col = 8 if ms > self.FRAME_MS else 11
+            pyxel.line(x + i, bottom, x + i, bottom - h + 1, col)
+        pyxel.text(x + HUD_HISTORY + 4, y + 5, f"max {peak:.1f}ms", 7)
+
+
 class NavBtn:
     DOWN = 0
     LEFT = 1
@@ -230,17 +1504,27 @@ class NavBtn:
 
 
 class App:
-    def __init__(self):
+    def __init__(self, watch_interval: float | None = None, run: bool = True):
+        """run=False ならメインループを開始しない（書き出しなど画面なしで使う場合）"""
         self.fps = FPS()
-        pyxel.init(
-            WIDTH + WINDOW_PADDING * 2,
-            HEIGHT + WINDOW_PADDING,
-            title=TITLE,
-            quit_key=pyxel.KEY_NONE,
-        )
+        self.hud = PerfHud(self)
+        self.watcher = None
+        if watch_interval:
+            self.watcher = FileWatcher(watch_interval)
+            self.watcher.watch([MD_FILENAME])
+        with profile_phase("pyxel.init"):
+            pyxel.init(
+                WIDTH + WINDOW_PADDING * 2,
+                HEIGHT + WINDOW_PADDING,
+                title=TITLE,
+                quit_key=pyxel.KEY_NONE,
+            )
         self.colors = pyxel.colors.to_list()  # 親アプリ用のcolorsをバックアップ
+        self.palette = PaletteManager(self.colors)
+        self.scheduler = ChildScheduler()
+        self.banks = ResourceBanks()
         self._page = 0
-        self.child_apps = {}
+        self.children = ChildManager(self)
         nav_x, nav_y = pyxel.width - 20, pyxel.height - 20
         self.navs = [
             NavBtn(NavBtn.DOWN, nav_x, nav_y, 5, 9, self.go_next_page),
@@ -254,57 +1538,142 @@ class App:
         self.reset()
 
         # run forever
-        pyxel.run(self.update, self.draw)
+        if run:
+            pyxel.run(self.update, self.draw)
 
     def reset(self):
-        self.renderd_page_bank = [
-            (None, pyxel.Image(WIDTH, HEIGHT)),
-            (None, pyxel.Image(WIDTH, HEIGHT)),
-        ]
+        self.parse_cache = ParseCache()
+        self.render_bank = RenderBank()
+        self.prerenderer = Prerenderer(self)
+        self.nav_direction = "f"  # 直前のページ移動の向き (f: 進む, b: 戻る)
         self.first_pages_in_section = []  # セクションの開始ページ
-        self.slides = self.load_slides(MD_FILENAME)
+        with profile_phase("load_slides"):
+            self.slides = self.load_slides(MD_FILENAME)
         self._page = min(self.page, len(self.slides) - 1)  # ページが減った場合
         self.in_transition = [0, 0, "down"]  # (rate(1..0), old_page, direction)
-        for app in self.child_apps.values():
-            sys.modules.pop(app.__module__, None)
-        self.child_apps = {}  # page: app
+        self.children.clear()
         self.child_is_updated = False
-        self.links = {}  # page: [(x1, y1, x2, y2, url), ...]
+        self.display_lists = {}  # slide.digest: DisplayList
+        # 最初のページのレイアウト（フォントの読み込みを含む）と子アプリの読み込み
+        with profile_phase(f"show page {self.page}"):
+            self.children.show(self.page)
 
         # player
-        self.player_image = pyxel.Image.from_image("assets/urban_rpg.png")
+        with profile_phase("player image"):
+            self.player_image = pyxel.Image.from_image("assets/urban_rpg.png")
         # 現在のページに応じた位置に配置
         x = WIDTH * self.page // max(1, len(self.slides) - 1)
         y = pyxel.height - 16
         self.player = (x, y, 1, 0)  # (x, y, u, v) - 下向き静止状態
 
-    def load_slides(self, filepath) -> list[Slide]:
-        import markdown_it
+    def reload(self):
+        """スライドを読み直し、内容か参照ファイルが変わったスライドだけ作り直す
+
+        変わっていないスライドのレイアウト、レンダリング済み画像、子アプリは
+        新しいページ番号に付け替えて引き継ぐ。
+        """
+        old_slides = self.slides
+        self.first_pages_in_section = []
+        self.slides = self.load_slides(MD_FILENAME)
+        self._page = min(self.page, len(self.slides) - 1)  # ページが減った場合
+        self.in_transition = [0, 0, "down"]
+        self.prerenderer = Prerenderer(self)
+
+        digests = {slide.digest for slide in self.slides}
+        stale = {d for d, dl in self.display_lists.items() if dl.is_stale()}
+        self.display_lists = {
+            digest: dl
+            for digest, dl in self.display_lists.items()
+            if digest in digests and digest not in stale
+        }
+        images, dropped = self._remap_pages(old_slides, self.render_bank.images)
+        self.render_bank.images = collections.OrderedDict(images)
+        if dropped:
+            self.render_bank.spare = dropped[0]
+        self.children.remap(*self._remap_pages(old_slides, self.children.apps))
+        self.children.show(self.page)
+
+        old_digests = {slide.digest for slide in old_slides}
+        rebuilt = sum(
+            slide.digest not in old_digests or slide.digest in stale
+            for slide in self.slides
+        )
+        print(f"reload: {rebuilt} / {len(self.slides)} slides rebuilt")
+        self.prerenderer.schedule(self.prefetch_candidates(self.page))
+
+    def _remap_pages(self, old_slides: list[Slide], items: dict) -> tuple[dict, list]:
+        """旧ページ番号をキーにした items を、内容が同じスライドの新ページ番号に付け替える
 
-        md = markdown_it.MarkdownIt("gfm-like")
+        付け替え先のないもの（変更・削除されたスライドのもの）は2つ目の戻り値で返す。
+        """
+        pages = collections.defaultdict(list)  # digest: [新ページ番号, ...]
+        for page, slide in enumerate(self.slides):
+            if slide.digest in self.display_lists:
+                pages[slide.digest].append(page)
+        remapped, dropped = {}, []
+        for old_page, item in items.items():
+            new_pages = pages.get(old_slides[old_page].digest)
+            if new_pages:
+                remapped[new_pages.pop(0)] = item
+            else:
+                dropped.append(item)
+        return remapped, dropped
+
+    def load_slides(self, filepath) -> list[Slide]:
         path = Path(filepath).resolve().parent
         content = Path(filepath).read_text(encoding="utf-8")
-        tokens = md.parse(content)
         slides: list[Slide] = []
-        slide_tokens: list[markdown_it.token.Token] = []
         sec = 0
         page = 0
-        for token in tokens:
-            if token.type == "heading_open" and token.tag in ["h1", "h2", "h3"]:
-                if slide_tokens:
-                    slides.append(
-                        Slide(path, sec, page, slide_tokens, slide_tokens[0].tag)
-                    )
+        # 見出しごとに分割したソースを個別にパースし、変更のない部分はキャッシュを使う
+        sources = split_slide_sources(content)
+        self.parse_cache.load(filepath, content)
+        # 参照リンクの定義はデッキ全体で共有する（同じラベルは最初の定義を使う）
+        references = {}
+        for source in sources:
+            for label, reference in self.parse_cache.definitions(source).items():
+                references.setdefault(label, reference)
+        keys = []
+        for source in sources:
+            used = used_references(source, references)
+            keys.append(self.parse_cache.key(source, used))
+            groups = []
+            for token in self.parse_cache.parse(source, used):
+                if token.type == "heading_open" and token.tag in ["h1", "h2", "h3"]:
+                    if not groups or groups[-1]:
+                        groups.append([])
+                elif not groups:
+                    groups.append([])
+                groups[-1].append(token)
+
+            # 各スライドのソース範囲 (先頭トークンの行から次のスライドの直前まで)
+            lines = source.splitlines(keepends=True)
+            starts = [tokens[0].map[0] for tokens in groups] + [len(lines)]
+            for slide_tokens, start, end in zip(groups, starts, starts[1:]):
+                if slides:
                     page += 1
-                    sec = sec + 1 if token.tag in ("h1", "h2") else sec
-                    slide_tokens = []
-            slide_tokens.append(token)
-        if slide_tokens:
-            slides.append(Slide(path, sec, page, slide_tokens, slide_tokens[0].tag))
+                    sec = sec + 1 if slide_tokens[0].tag in ("h1", "h2") else sec
+                slide = Slide(path, sec, page, slide_tokens, slide_tokens[0].tag)
+                slide.source = "".join(lines[start:end])
+                # 使う参照リンクの定義が変わったときも作り直すようにハッシュに含める
+                slide.digest = ParseCache.key(
+                    slide.source, used_references(slide.source, references)
+                )
+                slides.append(slide)
+
+        if self.parse_cache.missed:
+            self.parse_cache.save(filepath, content, keys)
 
         for i, slide in enumerate(slides):
             if slide.level in ("h1", "h2"):
                 self.first_pages_in_section.append(i)
+
+        unsupported = Visitor.unsupported_types(
+            token for slide in slides for token in slide.tokens
+        )
+        if unsupported:
+            summary = ", ".join(f"{t}({n})" for t, n in unsupported.items())
+            print("unsupported tokens:", summary)
         return slides
 
     def load_child(
@@ -318,21 +1687,32 @@ class App:
         scale: float | None,
     ):
         dotted_module = filename.replace("/", ".").replace("\\", ".").replace(".py", "")
-        mod = __import__(dotted_module)
-        for attr in dotted_module.split(".")[1:]:
-            mod = getattr(mod, attr)
+        self.banks.fresh()  # 他の子アプリのリソースを書き換えないように
+        with profile_phase(f"child import {filename}"):
+            mod = __import__(dotted_module)
+            for attr in dotted_module.split(".")[1:]:
+                mod = getattr(mod, attr)
 
         # scale処理
         if scale is not None:
             width = int(width / scale)
             height = int(height / scale)
-        a = self.child_apps[page] = mod.App(width, height)
+        with profile_phase(f"child init {filename}"):
+            a = self.children.apps[page] = mod.App(width, height)
+        self.banks.capture(a)
+        if hasattr(a, "input"):
+            a.input = self.scheduler.input
         scale = scale or 1.0
         # x 座標は、左パディングのみ考慮
         a.__x = max((pyxel.width - width * scale) // 2, WINDOW_PADDING)
         a.__y = y
         a.__colors = pyxel.colors.to_list()  # colorsバックアップ
+        # 親のパレットで描画できるなら色の置き換え表、できなければ None
+        a.__pal = self.palette.remap_table(a.__colors)
+        self.palette.sync()
         a.__scale = scale
+        a.__rendered = None  # 前回の render() の結果
+        a.__rendered_version = None
 
     @property
     def page(self):
@@ -342,7 +1722,10 @@ class App:
     def page(self, new_page):
         old_page, self._page = self._page, new_page
         if old_page != new_page:
+            self.nav_direction = "f" if old_page < new_page else "b"
             self.render_page(new_page)
+            self.children.show(new_page)
+            self.prerenderer.schedule(self.prefetch_candidates(new_page))
 
         if old_page < new_page:  # forward
             self.in_transition = [
@@ -382,6 +1765,21 @@ class App:
         sec = max(self.slides[self.page].sec - 1, 0)
         self.page = self.first_pages_in_section[sec]
 
+    def prefetch_candidates(self, page: int) -> list[int]:
+        """次に表示されそうなページ（直前の移動の向きを優先）"""
+        sections = self.first_pages_in_section
+        sec = self.slides[page].sec
+        forward = [page + 1, sections[min(sec + 1, len(sections) - 1)]]
+        backward = [page - 1, sections[max(sec - 1, 0)]]
+        if self.nav_direction == "b":
+            forward, backward = backward, forward
+        candidates = []
+        for p in forward + backward:
+            if 0 <= p < len(self.slides) and p != page and p not in candidates:
+                candidates.append(p)
+        # 表示中と切替元のページを追い出さない範囲で先読みする
+        return candidates[: self.render_bank.capacity - 2]
+
     def update_child(self):
         """子アプリの更新
 
@@ -390,22 +1788,36 @@ class App:
         - transition中でない
         - マウスが子アプリ内にある
         """
-        if self.page not in self.child_apps:
+        if self.page not in self.children:
             return False
         if self.in_transition[0] > 0:
             return False
 
-        a = self.child_apps[self.page]
+        a = self.children[self.page]
         if (a.__x <= pyxel.mouse_x - WINDOW_PADDING < a.__scale * a.width + a.__x) and (
             a.__y <= pyxel.mouse_y - WINDOW_PADDING < a.__scale * a.height + a.__y
         ):
-            a.update()
+            self.scheduler.tick(a, self.scheduler.clock())
             return True
 
+        self.scheduler.pause(a)
         return False
 
     def update(self):
+        if pyxel.btnp(HUD_KEY):
+            self.hud.toggle()
+        if not self.hud.visible:
+            self.update_frame()
+            return
+        start = time.perf_counter()
+        self.update_frame()
+        self.hud.update_ms = (time.perf_counter() - start) * 1000
+
+    def update_frame(self):
         self.fps.calc()
+        if self.watcher and (changed := self.watcher.poll(time.monotonic())):
+            print("changed:", ", ".join(sorted(changed)))
+            self.reload()
         self.child_is_updated = self.update_child()
         if self.child_is_updated:
             return
@@ -414,7 +1826,7 @@ class App:
             pyxel.quit()
 
         if pyxel.btnp(pyxel.KEY_R) and pyxel.btn(pyxel.KEY_CTRL):
-            self.reset()
+            self.reload()
 
         if self.in_transition[0] > 0:
             self.in_transition[0] = self.in_transition[0] - 3 / self.fps
@@ -426,16 +1838,16 @@ class App:
         for nav in self.navs:
             nav.update()
 
+        if self.in_transition[0] <= 0:
+            self.prerenderer.step()
+
         self.update_player()
 
     def check_link_click(self):
         """マウス位置がリンク領域内ならブラウザで開く"""
-        if self.page not in self.links:
-            return
-
         mx = pyxel.mouse_x - WINDOW_PADDING
         my = pyxel.mouse_y - WINDOW_PADDING
-        for x1, y1, x2, y2, url in self.links[self.page]:
+        for x1, y1, x2, y2, url in self.layout_page(self.page).links:
             if x1 <= mx <= x2 and y1 <= my <= y2:
                 webbrowser.open(url)
                 return
@@ -508,6 +1920,8 @@ class App:
         self.draw_players([{"player": self.player, "id": 0 }])
 
     def draw(self):
+        if self.hud.visible:
+            start = time.perf_counter()
         pyxel.cls(7)
         self.blt_slide()
         # 子アプリの描画
@@ -515,30 +1929,55 @@ class App:
         self.blt_player()
         # Navigation
         self.draw_nav()
-        # FPSを表示
-        # pyxel.text(5, pyxel.height - 10, f"FPS: {self.fps}", 13)
+        if self.hud.visible:
+            self.hud.draw((time.perf_counter() - start) * 1000)
+
+        if PROFILER and not PROFILER.finished:
+            # 最初のフレームを描画したら起動プロファイルを出力して終了
+            PROFILER.finish()
+            pyxel.quit()
+
+    def layout_page(self, page: int) -> DisplayList:
+        """ページのレイアウト結果を返す（スライドの内容ハッシュごとにキャッシュ）"""
+        slide = self.slides[page]
+        dl = self.display_lists.get(slide.digest)
+        if dl is None:
+            with profile_phase(f"layout {page}"):
+                visitor = Visitor(self, page)
+                visitor.walk(slide.tokens)
+                dl = self.add_layout(page, visitor.img.build())
+        return dl
+
+    def add_layout(self, page: int, dl: DisplayList) -> DisplayList:
+        """page のレイアウト結果を登録する"""
+        self.display_lists[self.slides[page].digest] = dl
+        if self.watcher:
+            self.watcher.watch(path for path, _ in dl.deps)
+        return dl
 
     def render_page(self, page: int) -> pyxel.Image:
-        """render page to old image bank"""
-        for p, img in self.renderd_page_bank:
-            if p == page:
-                return img
-
-        _, img = self.renderd_page_bank.pop(0)
-        img.rect(0, 0, WIDTH, HEIGHT, 7)
-        visitor = Visitor(self, page, img)
-        visitor.walk(self.slides[page].tokens)
-        self.renderd_page_bank.append((page, img))
+        """render page to image bank"""
+        img = self.render_bank.get(page)
+        if img is not None:
+            self.render_bank.hits += 1
+            return img
+        self.render_bank.misses += 1
+        start = time.perf_counter()
+        img = self.prerenderer.finish(page)  # 先読み中なら続きから描画
+        if img is None:
+            with profile_phase(f"render_page {page}"):
+                img = self.render_bank.allocate(page)
+                img.rect(0, 0, WIDTH, HEIGHT, 7)
+                self.layout_page(page).replay(img)
+        if self.hud.visible:
+            self.hud.record_render((time.perf_counter() - start) * 1000)
         return img
 
     def get_rendered_img(self, page: int):
-        for i, (p, img) in enumerate(self.renderd_page_bank):
-            if p == page:
-                used = self.renderd_page_bank.pop(i)
-                self.renderd_page_bank.append(used)
-                return img
-        else:
-            return self.render_page(page)
+        img = self.render_bank.get(page)
+        if img is None:
+            img = self.render_page(page)
+        return img
 
     def blt_slide(self):
         if self.in_transition[0] > 0:
@@ -582,22 +2021,34 @@ class App:
 
     def blt_child(self):
         """子アプリのオーバーレイ"""
-        if self.page not in self.child_apps:
-            pyxel.colors.from_list(self.colors)  # 親アプリ用のcolorsに切替
+        if self.page not in self.children:
+            self.palette.use(self.colors)  # 親アプリ用のcolorsに切替
             return
         if self.in_transition[0] > 0:
             return
 
-        a = self.child_apps[self.page]
-        pyxel.colors.from_list(a.__colors)  # 子アプリ用のcolorsに切替
-        g = a.render()
+        a = self.children[self.page]
+        if a.__pal is None:
+            self.palette.use(a.__colors)  # 子アプリ用のcolorsに切替
+        else:
+            self.palette.use(self.colors)
+        # render_version (任意) が前回と同じなら描画済みの画像を使う
+        version = getattr(a, "render_version", None)
+        if version is None or a.__rendered is None or version != a.__rendered_version:
+            a.__rendered = self.scheduler.render(a)
+            a.__rendered_version = version
+        g = a.__rendered
         x = max((pyxel.width - g.width) // 2, WINDOW_PADDING)
         x = WINDOW_PADDING + a.__x
         y = WINDOW_PADDING + a.__y
         s1 = a.__scale or 1
         s2 = (1 - s1) / 2
         w, h = g.width, g.height
+        for c1, c2 in (a.__pal or {}).items():
+            pyxel.pal(c1, c2)
         pyxel.blt(x - int(w * s2), y - int(h * s2), g, 0, 0, w, h, scale=a.__scale)
+        if a.__pal:
+            pyxel.pal()
         if self.child_is_updated:
             pyxel.rectb(x, y, int(w * s1), int(h * s1), 8)
 
@@ -625,6 +2076,37 @@ class App:
         # self.navs[NavBtn.PREV].draw() # SHIFT+SPACE は描画しない
 
 
+def break_lines(
+    text: str, widths: list[int], max_width: int, kinsoku: bool = False
+) -> list[int]:
+    """text を max_width に収まるように折り返し、各行の終了位置のリストを返す
+
+    widths は text の文字ごとの幅。先頭から幅を積算して1パスで区切り位置を決める。
+    各行は幅が max_width を超えない最長の文字列（1文字も入らない場合は1文字）。
+    kinsoku=True では、行頭禁則文字を前の行末の文字ごと次の行に追い出し、
+    行末禁則文字も次の行に送る。
+    """
+    breaks = []
+    start = 0
+    line_width = 0
+    for i, w in enumerate(widths):
+        if line_width + w > max_width and i > start:
+            end = i
+            if kinsoku:
+                while end - 1 > start and (
+                    text[end] in KINSOKU_NOT_AT_START
+                    or text[end - 1] in KINSOKU_NOT_AT_END
+                ):
+                    end -= 1
+            breaks.append(end)
+            line_width = sum(widths[end:i])
+            start = end
+        line_width += w
+    if start < len(widths):
+        breaks.append(len(widths))
+    return breaks
+
+
 def use_font(font: str):
     def decorator(func):
         def wrapper(self, token):
@@ -656,13 +2138,134 @@ def with_color(self, fg: int, bg: int):
     self.color_stack.pop()
 
 
+class Highlighter:
+    """コードブロックのシンタックスハイライト
+
+    Pygments のトークン列を (色, 文字列) の並びに変換し、(言語, 内容) ごとに覚えておく。
+    改行は (None, "\\n") で表す。色はトークン型の親をたどって TOKEN_COLORS から決め、
+    結果は型ごとに覚えておく。モジュール全体で共有するのでリロード後も使い回せる。
+    """
+
+    TOKEN_COLORS = {
+        "Keyword": 6,
+        "Operator.Word": 2,
+        "Literal.String.Double": 10,
+    }
+    CACHE_SIZE = 256  # 覚えておくコードブロックの数
+    CHUNK = 64  # highlight_steps が1回に処理する Pygments のトークン数
+
+    def __init__(self):
+        self.lexers = {}  # lang: Lexer
+        self.colors = {}  # token type: color | None
+        self.runs = collections.OrderedDict()  # (lang, content): runs
+        self.hits = 0
+        self.misses = 0
+
+    def lexer(self, lang: str):
+        lexer = self.lexers.get(lang)
+        if lexer is None:
+            from pygments.lexers import get_lexer_by_name
+
+            lexer = self.lexers[lang] = get_lexer_by_name(lang, stripall=True)
+        return lexer
+
+    def color(self, ttype) -> int | None:
+        """トークン型の色。自身か祖先が TOKEN_COLORS にあればその色、なければ None"""
+        try:
+            return self.colors[ttype]
+        except KeyError:
+            pass
+        color = None
+        t = ttype
+        while t is not None:
+            name = ".".join(t)
+            if name in self.TOKEN_COLORS:
+                color = self.TOKEN_COLORS[name]
+                break
+            t = t.parent
+        self.colors[ttype] = color
+        return color
+
+    def highlight(self, lang: str, content: str) -> tuple[tuple[int | None, str], ...]:
+        return drain(self.highlight_steps(lang, content))
+
+    def highlight_steps(self, lang: str, content: str):
+        """highlight と同じ結果を返すジェネレーター（CHUNK トークンごとに yield する）"""
+        key = (lang, content)
+        runs = self.runs.get(key)
+        if runs is not None:
+            self.hits += 1
+            self.runs.move_to_end(key)
+            return runs
+
+        self.misses += 1
+        result = []
+        tokens = self.lexer(lang).get_tokens(content)
+        for n, (ttype, value) in enumerate(tokens, 1):
+            if n % self.CHUNK == 0:
+                yield
+            color = self.color(ttype)
+            for i, part in enumerate(value.split("\n")):
+                if i:
+                    result.append((None, "\n"))
+                if part:
+                    result.append((color, part))
+        runs = self.runs[key] = tuple(result)
+        if len(self.runs) > self.CACHE_SIZE:
+            self.runs.popitem(last=False)
+        return runs
+
+
+HIGHLIGHTER = Highlighter()
+
+
+def _noop(visitor, token):
+    pass
+
+
+def drain(steps):
+    """ジェネレーターを最後まで進めて、その戻り値を返す"""
+    while True:
+        try:
+            next(steps)
+        except StopIteration as e:
+            return e.value
+
+
+class DispatchTable(dict):
+    """token.type → (visit_*, depart_*) の表
+
+    Visitor のクラスごとに1回だけ作る。未対応の type は何もしないエントリを追加し、
+    unknown に記録する。prepare_* は prepares に type ごとに持つ。
+    """
+
+    def __init__(self, cls: type):
+        super().__init__()
+        self.unknown = set()
+        self.prepares = {}  # token.type: prepare_*
+        for name in dir(cls):
+            if name.startswith("prepare_"):
+                self.prepares[name.split("_", 1)[1]] = getattr(cls, name)
+            elif name.startswith(("visit_", "depart_")):
+                token_type = name.split("_", 1)[1]
+                self[token_type] = (
+                    getattr(cls, f"visit_{token_type}", _noop),
+                    getattr(cls, f"depart_{token_type}", _noop),
+                )
+
+    def __missing__(self, token_type: str):
+        self.unknown.add(token_type)
+        entry = self[token_type] = (_noop, _noop)
+        return entry
+
+
 class Visitor:
     list_stack: list[tuple[str, int]]
     color_stack: list[tuple[int, int]]
 
-    def __init__(self, app: App, page: int, img: pyxel.Image):
+    def __init__(self, app: App, page: int):
         self.app = app
-        self.img = img
+        self.img = DisplayListBuilder(WIDTH, HEIGHT)
         self.page = page
         self.x = 0
         self.y = 0
@@ -673,7 +2276,7 @@ class Visitor:
         self.align = "left"
         self.list_stack = []  # 箇条書きのマーク用
         self.current_link = None  # リンク情報: {"x": x, "y": y, "url": url}
-        self.app.links[page] = []
+        self.deadline = None  # 先読み中はこのフレームの締め切り (time.perf_counter)
 
     @property
     def color(self):
@@ -687,9 +2290,13 @@ class Visitor:
     def font(self):
         return FONTS[self.font_stack[-1]]
 
+    @property
+    def metrics(self):
+        return FONTS.metrics(self.font_stack[-1])
+
     @property
     def font_height(self):
-        return self.font.text_width("あ")  # あの幅を文字の高さとする
+        return self.metrics.line_height
 
     @property
     def list_marker(self):
@@ -701,7 +2308,7 @@ class Visitor:
             return LIST_MARKERS[list_level]  # 深いとエラーになるけど実質問題ない
 
     def _text(self, text):
-        w = self.font.text_width(text)
+        w = self.metrics.text_width(text)
         # アラインメント
         if self.align == "center":
             self.x = (WIDTH - w) // 2
@@ -740,26 +2347,59 @@ class Visitor:
         dedent = self.indent_stack.pop() - self.indent_stack[-1]
         self.x -= dedent
 
+    @classmethod
+    def dispatch_table(cls) -> DispatchTable:
+        table = cls.__dict__.get("_dispatch_table")
+        if table is None:
+            table = DispatchTable(cls)
+            cls._dispatch_table = table
+        return table
+
+    @classmethod
+    def unsupported_types(cls, tokens) -> collections.Counter:
+        """tokens（子トークンを含む）のうち、対応する visit_* がない type を数える"""
+        table = cls.dispatch_table()
+        counter = collections.Counter()
+        stack = [tokens]
+        while stack:
+            for token in stack.pop():
+                if token.type not in table or table[token.type][0] is _noop:
+                    counter[token.type] += 1
+                if token.children:
+                    stack.append(token.children)
+        return counter
+
     def walk(self, tokens):
-        for token in tokens:
-            self.visit(token)
-            if token.children:
-                self.walk(token.children)
-            self.depart(token)
-
-    def visit(self, token):
-        method_name = f"visit_{token.type}"
-        if hasattr(self, method_name):
-            method = getattr(self, method_name)
-            method(token)
-        else:
-            print("visit", token.type)
+        drain(self.steps(tokens))
 
-    def depart(self, token):
-        method_name = f"depart_{token.type}"
-        if hasattr(self, method_name):
-            method = getattr(self, method_name)
-            method(token)
+    def steps(self, tokens):
+        """tokens を順に処理するジェネレーター（1トークンごとに yield する）
+
+        prepare_* のあるトークンは、visit_* の前に prepare_* を進める。prepare_* は
+        重い処理（ハイライト、画像の読み込み、コードブロックの画像化）を小分けにして
+        yield しながらキャッシュに入れるので、先読みではフレームをまたいで進められる。
+        """
+        table = self.dispatch_table()
+        prepares = table.prepares
+        stack = [(iter(tokens), None)]  # (兄弟トークン, 親トークン)
+        while stack:
+            siblings, parent = stack[-1]
+            token = next(siblings, None)
+            if token is None:
+                stack.pop()
+                if parent is not None:
+                    table[parent.type][1](self, parent)
+                continue
+            prepare = prepares.get(token.type)
+            if prepare is not None:
+                yield from prepare(self, token)
+            visit, depart = table[token.type]
+            visit(self, token)
+            if token.children:
+                stack.append((iter(token.children), token))
+            else:
+                depart(self, token)
+            yield
 
     def visit_heading_open(self, token):
         if token.tag == "h1":
@@ -789,16 +2429,13 @@ class Visitor:
         max_width = WIDTH - self.x
         if DEBUG:
             self.img.rectb(self.x, self.y, max_width, self.font_height, 2)
-        while content:
-            i = len(content)
-            w = self.font.text_width(content)
-            while w > max_width:
-                i -= 1
-                w = self.font.text_width(content[:i])
-            self._text(content[:i])
-            content = content[i:]
-            if content:
+        widths = self.metrics.char_widths(content)
+        start = 0
+        for end in break_lines(content, widths, max_width, KINSOKU):
+            if start:
                 self._crlf(wrap_margin=True)
+            self._text(content[start:end])
+            start = end
 
     def visit_bullet_list_open(self, token):
         self._indent(WINDOW_PADDING)
@@ -826,7 +2463,7 @@ class Visitor:
         x = self.x
         self._text(self.list_marker)  # 本当はここでマイナスインデントするのが良いかも？
         self.x = x  # 元の位置に戻す
-        self._indent(max(self.font_height, self.font.text_width(self.list_marker)))
+        self._indent(max(self.font_height, self.metrics.text_width(self.list_marker)))
 
     def visit_list_item_close(self, token):
         self._dedent()
@@ -871,7 +2508,7 @@ class Visitor:
             self.img.line(x, y + self.font_height, self.x, y + self.font_height, 5)
             # リンク領域を登録
             if url:
-                self.app.links[self.page].append((x, y, self.x, y + self.font_height, url))
+                self.img.links.append((x, y, self.x, y + self.font_height, url))
             self.current_link = None
 
     @use_font("literal")
@@ -879,17 +2516,73 @@ class Visitor:
     def visit_code_inline(self, token):
         self._text(token.content)
 
+    def prepare_fence(self, token):
+        """visit_fence の重い処理を小分けにして先に済ませる（結果はキャッシュに入る）"""
+        if token.info and directive_pattern.match(token.info):
+            yield from self._prepare_figure(token)
+        elif self._fence_key(token) not in FENCE_SPRITES:
+            yield from self._rasterize_fence(token)
+
     @use_font("literal")
     @use_color(7, -1)
     def visit_fence(self, token):
         if token.info and directive_pattern.match(token.info):
             return self._directive(token)
 
+        # 1度だけ画像にしておき、以降は貼り付けるだけにする
+        sprite = FENCE_SPRITES.get(self._fence_key(token))
+        if sprite is None:  # prepare_fence の後で追い出された場合
+            sprite = drain(self._rasterize_fence(token))
+        image, dx, dy = sprite
+        self.img.blt(self.x, self.y, image, 0, 0, image.width, image.height)
+        self.x += dx
+        self.y += dy
+
+    def _fence_key(self, token) -> tuple:
+        return (token.info, token.content, FONTS.files["literal"])
+
+    def _rasterize_fence(self, token):
+        """コードブロックを画像にして FENCE_SPRITES に入れ、(image, dx, dy) を返す
+
+        ハイライトと画像への描画を小分けにして yield する（描画は deadline まで）。
+        画像はキーに含まない状態に左右されないように、左寄せで描画する（中央寄せの
+        ## のスライドでも左寄せ。以前は行ごとに中央寄せで、背景の外に描いていた）。
+        ページより大きい部分は表示されないので、画像はページの大きさまでにする。
+        """
+        if token.info:
+            yield from HIGHLIGHTER.highlight_steps(token.info, token.content)
+        page_img, x, y, align = self.img, self.x, self.y, self.align
+        self.img = DisplayListBuilder(WIDTH, HEIGHT)
+        self.align = "left"
+        self.font_stack.append("literal")
+        self.color_stack.append((7, -1))
+        w, h = yield from self._draw_fence(token)
+        self.font_stack.pop()
+        self.color_stack.pop()
+        dl = self.img.build()
+        dx, dy = self.x - x, self.y - y
+        self.img, self.x, self.y, self.align = page_img, x, y, align
+
+        image = pyxel.Image(min(w, WIDTH), min(h, HEIGHT))
+        i = 0
+        while True:
+            image.camera(x, y)
+            i = dl.replay(image, i, self.deadline)
+            image.camera()
+            if i == len(dl.ops):
+                break
+            yield
+        sprite = (image, dx, dy)
+        FENCE_SPRITES.put(self._fence_key(token), sprite)
+        return sprite
+
+    def _draw_fence(self, token):
+        """コードブロックを描画して背景の大きさを返す（FENCE_CHUNK 行ごとに yield する）"""
         content = token.content
 
         # 背景描画
-        hls = [self.font.text_width(line) for line in content.splitlines()]
-        lh = self.font.text_width("あ")  # あの幅を文字の高さとする
+        hls = [self.metrics.text_width(line) for line in content.splitlines()]
+        lh = self.font_height
         w = lh + max(hls)
         h = lh + len(hls) * lh  # 余白用に1行多く確保
         self.img.rect(self.x, self.y, w, h, 0)
@@ -899,14 +2592,17 @@ class Visitor:
         self.y += lh // 2
 
         if token.info:
-            self._highlight(token)
+            yield from self._highlight(token)
         else:
-            for line in content.splitlines():
+            for n, line in enumerate(content.splitlines(), 1):
                 self._text(line)
                 self._crlf()
+                if n % FENCE_CHUNK == 0:
+                    yield
 
         self.y += DEFAULT_LINE_HEIGHT // 2
         self._dedent()
+        return w, h
 
     def _directive(self, token):
         """ディレクティブ処理
@@ -927,29 +2623,20 @@ class Visitor:
             - `wdith`: 200 （200px 表記は非対応）
             - `height`: 100 （100px 表記は非対応）
         """
-        m = directive_pattern.match(token.info)
-        directive, args = m.groups()
-        if directive != "figure":
+        directive, args = directive_pattern.match(token.info).groups()
+        figure = self._figure(token)
+        if figure is None:
             print("unsupported directive", directive)
             return
-        options = dict(directive_option_pattern.findall(token.content))
-        slide = self.app.slides[self.page]
-        path = slide.path / args
-        matches = {}  # .ext : path
-
-        if path.suffix == ".*":
-            for fname in path.parent.glob(path.name):
-                if fname.suffix in [".py", ".png", ".jpg"]:
-                    matches[fname.suffix] = fname
-        else:
-            matches[path.suffix] = path
+        options, matches = figure
 
         if ".py" in matches:
             s = int(options.pop("scale", 100)) / 100 if "scale" in options else None
             w = int(options.pop("width", 355))
             h = int(options.pop("height", 200))
             module_file = matches[".py"].relative_to(Path().absolute())
-            self.app.load_child(self.page, self.x, self.y, w, h, str(module_file), s)
+            self.img.children.append((self.x, self.y, w, h, str(module_file), s))
+            self.img.depend(module_file)
             if options:
                 print("Unsupported options", options)
             return
@@ -957,52 +2644,87 @@ class Visitor:
         for ext in (".png", ".jpg"):
             if ext not in matches:
                 continue
-            p = pyxel.Image.from_image(str(matches[ext]))
-            if "scale" in options:
-                s = int(options["scale"]) / 100
-            else:
-                s = self.img.width / max(p.width, self.img.width)
-            x, y, w, h = self.x, self.y, p.width, p.height
+            pxi, w, h, s = self._figure_image(matches[ext], options)
+            self.img.depend(matches[ext])
+            x, y = self.x, self.y
             lm = max(int(self.img.width - w * s) // 2, 0)
-            self.img.blt(
-                lm + x - int(w * (1 - s) / 2),
-                y - int(h * (1 - s) / 2),
-                p,
-                0,
-                0,
-                w,
-                h,
-                scale=s,
-            )
+            if pxi is not None and pxi[3] == s:
+                # make.py images で拡大縮小・減色済み
+                sp = pxi[0]
+                self.img.blt(lm + x, y, sp, 0, 0, sp.width, sp.height)
+                return
+            scaled = ASSETS.scaled(matches[ext], s)
+            if scaled is None:
+                self.img.blt(
+                    lm + x - int(w * (1 - s) / 2),
+                    y - int(h * (1 - s) / 2),
+                    ASSETS.image(matches[ext]),
+                    0,
+                    0,
+                    w,
+                    h,
+                    scale=s,
+                )
+            else:
+                # 拡大縮小済みの画像を貼るだけ
+                sp, u, v, sw, sh, dx, dy = scaled
+                self.img.blt(lm + x + dx, y + dy, sp, u, v, sw, sh)
             return
 
         print("Not Found.", args)
 
+    def _figure(self, token) -> tuple[dict, dict[str, Path]] | None:
+        """{figure} の (options, {拡張子: パス}) を返す（ほかのディレクティブは None）"""
+        directive, args = directive_pattern.match(token.info).groups()
+        if directive != "figure":
+            return None
+        options = dict(directive_option_pattern.findall(token.content))
+        path = self.app.slides[self.page].path / args
+        if path.suffix == ".*":
+            return options, ASSETS.glob(path, [".py", ".png", ".jpg"])
+        return options, {path.suffix: path}
+
+    def _figure_image(self, path: Path, options: dict):
+        """画像を読み込み (pxi | None, 幅, 高さ, 拡大率) を返す"""
+        pxi = ASSETS.pxi(path)
+        if pxi is not None:
+            w, h = pxi[1], pxi[2]
+        else:
+            p = ASSETS.image(path)
+            w, h = p.width, p.height
+        if "scale" in options:
+            s = int(options["scale"]) / 100
+        else:
+            s = self.img.width / max(w, self.img.width)
+        return pxi, w, h, s
+
+    def _prepare_figure(self, token):
+        """{figure} の画像の読み込みと拡大縮小を1つずつ済ませる"""
+        figure = self._figure(token)
+        if figure is None or ".py" in figure[1]:
+            return
+        options, matches = figure
+        for ext in (".png", ".jpg"):
+            if ext in matches:
+                pxi, _, _, s = self._figure_image(matches[ext], options)
+                yield
+                if pxi is None or pxi[3] != s:
+                    ASSETS.scaled(matches[ext], s)
+                    yield
+                return
+
     def _highlight(self, token):
-        import pygments
-        from pygments.formatters import RawTokenFormatter
-        from pygments.lexers import get_lexer_by_name
-
-        lexer = get_lexer_by_name(token.info, stripall=True)
-        formatter = RawTokenFormatter()
-        hl = pygments.highlight(token.content, lexer, formatter).decode("utf-8")
-
-        for line in hl.splitlines():
-            token, value = line.split("\t")
-            value = value.strip("'")
-            match token:
-                case "Token.Text.Whitespace" if value == "\\n":
-                    self._crlf()
-                case s if s.startswith("Token.Keyword"):
-                    with with_color(self, 6, -1):
-                        self._text(value)
-                case "Token.Operator.Word":
-                    with with_color(self, 2, -1):
-                        self._text(value)
-                case "Token.Literal.String.Double":
-                    with with_color(self, 10, -1):
-                        self._text(value)
-                case _:
+        lines = 0
+        for color, value in HIGHLIGHTER.highlight(token.info, token.content):
+            if value == "\n":
+                self._crlf()
+                lines += 1
+                if lines % FENCE_CHUNK == 0:
+                    yield
+            elif color is None:
+                self._text(value)
+            else:
+                with with_color(self, color, -1):
                     self._text(value)
 
     def visit_hardbreak(self, token):
@@ -1022,6 +2744,11 @@ class Visitor:
 
 # micropipがasync/awaitを要求するため
 async def main():
+    global PROFILER
+
+    args = parse_args()
+    if args.profile_startup:
+        PROFILER = StartupProfiler(args.profile_output)
     try:
         import micropip
     except ImportError:
@@ -1029,12 +2756,42 @@ async def main():
 
     if micropip:
         print("Installing ...")
-        await micropip.install("markdown-it-py")
-        await micropip.install("linkify-it-py")
-        await micropip.install("pygments")
+        with profile_phase("micropip install"):
+            await micropip.install("markdown-it-py")
+            await micropip.install("linkify-it-py")
+            await micropip.install("pygments")
         print("installed successfully")
 
-    App()
+    App(watch_interval=args.watch_interval if args.watch else None)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py", description=TITLE)
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="スライドと参照ファイルの更新を監視して、変更のあったスライドを作り直す",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        default=WATCH_INTERVAL,
+        metavar="SEC",
+        help=f"更新を調べる間隔 (default: {WATCH_INTERVAL})",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="起動の各フェーズの時間とメモリを計測し、最初のフレームを描画したら終了する",
+    )
+    parser.add_argument(
+        "--profile-output",
+        default="startup-profile.json",
+        metavar="PATH",
+        help="起動プロファイルの出力先 (default: startup-profile.json)",
+    )
+    args, _ = parser.parse_known_args(argv)
+    return args
 
 
 if __name__ == "__main__":
@@ -0,0 +1,13 @@
+"""拡大縮小・減色済みの画像 (.pxi) の形式
+
+make.py images が書き出し、main.py が読む。形式を変えたら PXI_MAGIC を変える。
+
+ヘッダー: magic, 元の幅, 元の高さ, 幅, 高さ, scale, 元画像のSHA-1。
+続けて1ピクセル1バイトのパレット番号。同じ画像からは同じバイト列になるように、
+更新時刻などファイルの状態は入れない。
+"""
+
+import struct
+
+PXI_HEADER = struct.Struct("<4sHHHHd20s")
+PXI_MAGIC = b"PXI3"
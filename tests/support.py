@@ -0,0 +1,23 @@
+"""テスト共通の準備（画面なしで pyxel を使う）"""
+
+import functools
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("SDL_VIDEODRIVER", "offscreen")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+ROOT = Path(__file__).resolve().parent.parent
+APP_DIR = ROOT / "pyxel-slide"
+os.chdir(APP_DIR)
+sys.path.insert(0, str(APP_DIR))
+sys.path.insert(0, str(ROOT))
+
+import main  # noqa: E402
+
+
+@functools.cache
+def get_app() -> main.App:
+    """テスト全体で共有する App（pyxel.init は1プロセスで1回しか呼べない）"""
+    return main.App(run=False)
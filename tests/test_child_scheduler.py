@@ -0,0 +1,71 @@
+"""子アプリの update を呼ぶ ChildScheduler のテスト
+
+python -m unittest discover tests
+"""
+
+import unittest
+from unittest import mock
+
+from support import get_app, main
+
+INTERVAL = 1 / main.CHILD_TICK_RATE
+
+
+class Child:
+    """update の回数と、押されたと判定したボタンの回数を数える子アプリ"""
+
+    def __init__(self, keys=None):
+        if keys is not None:
+            self.input = keys
+        self.updates = 0
+        self.presses = 0
+
+    def update(self):
+        keys = getattr(self, "input", main.pyxel)
+        self.updates += 1
+        self.presses += keys.btnp(main.pyxel.KEY_SPACE)
+
+
+class ChildSchedulerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        get_app()
+
+    def setUp(self):
+        self.scheduler = main.ChildScheduler()
+        patcher = mock.patch.object(main.pyxel, "btnp", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def catch_up(self, child) -> int:
+        """3フレーム分遅れた状態で tick する"""
+        self.scheduler.tick(child, 0.0)
+        return self.scheduler.tick(child, INTERVAL * 3)
+
+    def test_press_counts_once_when_catching_up(self):
+        for child in (Child(), Child(self.scheduler.input)):
+            self.assertEqual(self.catch_up(child), 3)
+            self.assertEqual(child.updates, 4)
+            self.assertEqual(child.presses, 2)
+        # 置き換えた pyxel.btnp は元に戻り、ChildInput も追いつき中のままにならない
+        self.assertTrue(main.pyxel.btnp(main.pyxel.KEY_SPACE))
+        self.assertTrue(self.scheduler.input.btnp(main.pyxel.KEY_SPACE))
+
+    def test_button_patch_is_restored_after_error(self):
+        for child in (Child(), Child(self.scheduler.input)):
+            child.update = mock.Mock(side_effect=[None, None, RuntimeError])
+            with self.assertRaises(RuntimeError):
+                self.catch_up(child)
+            self.assertTrue(main.pyxel.btnp(main.pyxel.KEY_SPACE))
+            self.assertTrue(self.scheduler.input.btnp(main.pyxel.KEY_SPACE))
+
+    def test_heavy_child_runs_every_other_frame(self):
+        child = Child()
+        self.scheduler.timer(child).update_ms = self.scheduler.budget_ms * 2
+        calls = [self.scheduler.tick(child, i * INTERVAL) for i in range(6)]
+        self.assertEqual(calls, [0, 1, 0, 1, 0, 1])
+        self.assertEqual(self.scheduler.stats(child)["dropped"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
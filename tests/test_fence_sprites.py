@@ -0,0 +1,88 @@
+"""コードブロックの画像キャッシュ (FENCE_SPRITES) の回帰テスト
+
+python -m unittest discover tests
+"""
+
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from support import get_app, main
+
+FENCE = "```python\ndef f(x):\n    return x\n```\n"
+
+
+def text_pixels(image, x, y, w, h) -> int:
+    """(x, y, w, h) 内の文字色 (7) のピクセル数"""
+    return sum(image.pget(i, j) == 7 for j in range(y, y + h) for i in range(x, x + w))
+
+
+class FenceSpriteTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = get_app()
+        cls.tmp = tempfile.TemporaryDirectory()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        patcher = mock.patch.object(main, "CACHE_DIR", Path(self.tmp.name) / ".cache")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        main.FENCE_SPRITES.sprites.clear()
+        main.FENCE_SPRITES.bytes = 0
+
+    def load(self, text: str):
+        path = Path(self.tmp.name) / "deck.md"
+        path.write_text(text, encoding="utf-8")
+        app = self.app
+        app.parse_cache = main.ParseCache()
+        app.first_pages_in_section = []
+        app.slides = app.load_slides(path)
+        app.display_lists = {}
+        app.render_bank = main.RenderBank()
+
+    def fence_sprite(self):
+        """キャッシュにあるコードブロックの画像（1つだけのはず）"""
+        self.assertEqual(len(main.FENCE_SPRITES.sprites), 1)
+        return next(iter(main.FENCE_SPRITES.sprites.values()))[0]
+
+    def test_same_fence_on_centered_and_left_slides(self):
+        # 中央寄せの ## スライドで画像にしたものを ### スライドで使い回す
+        self.load(f"## Section\n\n{FENCE}\n### Left\n\n{FENCE}")
+        self.app.render_page(0)
+        image = self.fence_sprite()
+        self.assertGreater(text_pixels(image, 0, 0, image.width, image.height), 0)
+
+        img = self.app.render_page(1)
+        (op,) = [op for op in self.app.layout_page(1).ops if op[1][2] is image]
+        x, y = op[1][:2]
+        self.assertGreater(text_pixels(img, x, y, image.width, image.height), 0)
+
+    def test_tall_fence_is_clipped_to_the_page(self):
+        code = "\n".join(f"x{i} = {i}" for i in range(200))
+        self.load(f"### Long\n\n```python\n{code}\n```\n")
+        self.app.render_page(0)
+        image = self.fence_sprite()
+        self.assertLessEqual(image.height, main.HEIGHT)
+        self.assertLessEqual(image.width * image.height, main.FENCE_SPRITE_BUDGET)
+
+        # 2回目のレイアウトでは画像にし直さない
+        misses = main.FENCE_SPRITES.misses
+        self.app.display_lists = {}
+        self.app.layout_page(0)
+        self.assertEqual(main.FENCE_SPRITES.misses, misses)
+
+    def test_put_same_key_twice_counts_bytes_once(self):
+        # 先読みと layout_page が同じコードブロックを画像にした場合
+        cache = main.SpriteCache(main.FENCE_SPRITE_BUDGET)
+        for _ in range(2):
+            cache.put("key", (main.pyxel.Image(10, 20), 0, 20))
+        self.assertEqual(cache.bytes, 10 * 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+"""--watch の FileWatcher のテスト
+
+python -m unittest discover tests
+"""
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from support import main
+
+FRAME = 1 / 30
+
+
+class FileWatcherTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "deck.md"
+        self.path.write_text("0")
+        self.watcher = main.FileWatcher(interval=1.0, debounce=0.3)
+        self.watcher.watch([self.path])
+
+    def touch(self, t: float):
+        """t 秒に書き込んだことにする（更新時刻の粒度によらないように明示する）"""
+        self.path.write_text(str(t))
+        ns = int(t * 10**9) + 10**18
+        os.utime(self.path, ns=(ns, ns))
+
+    def run_frames(self, until: float, writes=()) -> list[float]:
+        """until 秒まで毎フレーム poll し、通知された時刻を返す"""
+        events = []
+        for frame in range(round(until / FRAME)):
+            t = round(frame * FRAME, 4)
+            if any(abs(t - w) < FRAME / 2 for w in writes):
+                self.touch(t)
+            if self.watcher.poll(t):
+                events.append(t)
+        return events
+
+    def test_change_is_confirmed_after_debounce(self):
+        # 1.0 秒の poll で検出し、interval を待たずに debounce 後に通知する
+        (event,) = self.run_frames(3, writes=[0.5])
+        self.assertAlmostEqual(event, 1.0 + 0.3, delta=FRAME)
+
+    def test_burst_of_writes_is_notified_once(self):
+        # 保存中に debounce より短い間隔で何度も書き込むエディタ
+        writes = [0.9, 1.1, 1.3, 1.5, 1.7]
+        (event,) = self.run_frames(4, writes=writes)
+        self.assertGreaterEqual(event, writes[-1] + 0.3)
+        self.assertLess(event, 3.0)  # 次の interval の poll までは待たない
+
+
+if __name__ == "__main__":
+    unittest.main()
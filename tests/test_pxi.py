@@ -0,0 +1,70 @@
+"""make.py が書く .pxi を main.py の AssetCache が読めることのテスト
+
+python -m unittest discover tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from support import APP_DIR, get_app, main
+
+import make
+
+
+class PxiTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        get_app()  # pyxel.Image を作れるように
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.src = Path(tmp.name) / "face.png"
+        shutil.copyfile(APP_DIR / "assets" / "face-dot.png", self.src)
+
+    def load(self):
+        return main.AssetCache().pxi(self.src)
+
+    def test_round_trip(self):
+        make.write_pxi(self.src, "50", dither=False)
+        image, src_w, src_h, scale = self.load()
+        original = main.AssetCache().image(self.src)
+        self.assertEqual((src_w, src_h, scale), (original.width, original.height, 0.5))
+        self.assertEqual(image.width, round(original.width * 0.5))
+
+    def test_output_does_not_depend_on_file_times(self):
+        first = make.write_pxi(self.src, "50", dither=False).read_bytes()
+        os.utime(self.src, ns=(0, 0))
+        self.assertEqual(
+            make.write_pxi(self.src, "50", dither=False).read_bytes(), first
+        )
+
+    def touch_source_after_pxi(self):
+        """元画像の更新時刻を .pxi より新しくする (git checkout の順番など)"""
+        pxi_mtime = self.src.with_name(self.src.name + ".pxi").stat().st_mtime_ns
+        os.utime(self.src, ns=(pxi_mtime + 10**9, pxi_mtime + 10**9))
+
+    def test_source_older_than_pxi_is_not_hashed(self):
+        make.write_pxi(self.src, None, dither=False)
+        with mock.patch.object(main.hashlib, "sha1") as sha1:
+            self.assertIsNotNone(self.load())
+        sha1.assert_not_called()
+
+    def test_touched_source_is_compared_by_content(self):
+        make.write_pxi(self.src, None, dither=False)
+        self.touch_source_after_pxi()
+        self.assertIsNotNone(self.load())
+
+    def test_changed_source_is_outdated(self):
+        make.write_pxi(self.src, None, dither=False)
+        self.src.write_bytes(self.src.read_bytes() + b"\0")
+        self.touch_source_after_pxi()
+        self.assertIsNone(self.load())
+
+
+if __name__ == "__main__":
+    unittest.main()